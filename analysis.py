@@ -0,0 +1,204 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from comps import CompMatcher
+from export import criteria_frame, export_filename, write_workbook
+from geo import ZIP_CENTROIDS_FILE, GeoCriteria, GeoMatcher, load_zip_centroids
+from perf import StageTimer
+from ingest import find_status_column, load_mls_file
+from store import CompsStore
+from valuation import ESTIMATES, PLAIN, Valuation, value_comps
+
+SORT_OPTIONS = ["ALL", "Area", "County", "City", "Sub"]
+
+
+# ===================== SUMMARY =====================
+def sold_totals(df_sold, sort_selection="ALL"):
+    # Sold_Count, Price_Sum and Priced (comps with a Sale Price) per sort group, or one
+    # row for ALL. CompsStore.sold_totals builds the same frame from the store.
+    price = pd.to_numeric(df_sold['Sale Price'], errors='coerce')
+    if sort_selection == "ALL":
+        return pd.DataFrame([{'Sold_Count': df_sold.shape[0], 'Price_Sum': price.sum(), 'Priced': price.count()}])
+    return df_sold.assign(_price=price).groupby(sort_selection, observed=True).agg(
+        Sold_Count=('MLS #', 'count'),
+        Price_Sum=('_price', 'sum'),
+        Priced=('_price', 'count'),
+    )
+
+
+def summarize(df_active, df_sold, sort_selection="ALL", sold=None):
+    # sold: sold_totals() for sort_selection, when df_sold isn't loaded (comps store).
+    if sold is None:
+        sold = sold_totals(df_sold, sort_selection)
+    sold = sold.assign(Avg_Sold_Price=sold['Price_Sum'] / sold['Priced'].where(sold['Priced'] > 0))
+    if sort_selection == "ALL":
+        summary = pd.DataFrame([{
+            'Listings_Count': df_active.shape[0],
+            'Sold_Count': int(sold['Sold_Count'].iloc[0]),
+            'Avg_List_Price': df_active['List Price'].mean(),
+            'Avg_Sold_Price': sold['Avg_Sold_Price'].iloc[0],
+        }])
+    else:
+        summary_active = df_active.groupby(sort_selection, observed=True).agg(
+            Listings_Count=('MLS #', 'count'),
+            Avg_List_Price=('List Price', 'mean')
+        )
+        summary = summary_active.join(sold[['Sold_Count', 'Avg_Sold_Price']], how='outer').reset_index()
+        summary.fillna({'Sold_Count': 0, 'Avg_Sold_Price': 0}, inplace=True)
+    summary['Sold - List ($)'] = summary['Avg_Sold_Price'] - summary['Avg_List_Price']
+    summary['Sold - List (%)'] = ((summary['Avg_Sold_Price'] - summary['Avg_List_Price']) / summary['Avg_List_Price'].replace(0, pd.NA)) * 100
+    if sort_selection != "ALL":
+        summary = summary.sort_values(by='Listings_Count', ascending=False)
+    return summary
+
+
+# ===================== CANDIDATES =====================
+def comp_results(matches, valuation=None, as_of=None):
+    if valuation is None or valuation == PLAIN:
+        num_comps, comp_price, price_diff, price_diff_pct = (
+            matches.num_comps, matches.avg_comp_price, matches.price_diff, matches.price_diff_pct)
+    else:
+        num_comps, comp_price, price_diff, price_diff_pct = value_comps(matches, valuation, as_of)
+    return pd.DataFrame({
+        'Avg Comp Price': comp_price,
+        'Price Diff ($)': price_diff,
+        'Price Diff (%)': price_diff_pct,
+        '# of Comps': num_comps,
+    })
+
+
+def rank_candidates(df_listings, results, sf_label='Total Finished SF'):
+    table = pd.DataFrame({
+        'Rank': 0,
+        'MLS #': df_listings['MLS #'].astype(str).to_numpy(),
+        'Address': df_listings['Address'].to_numpy(),
+        'Bedrooms': df_listings['Bedrooms'].to_numpy(),
+        sf_label: df_listings['Total Finished SF'].to_numpy(),
+        'List Price': df_listings['List Price'].to_numpy(),
+        'Avg Comp Price': results['Avg Comp Price'].to_numpy(),
+        'Price Diff ($)': results['Price Diff ($)'].to_numpy(),
+        'Price Diff (%)': results['Price Diff (%)'].to_numpy(),
+        '# of Comps': results['# of Comps'].to_numpy(),
+    })
+    table.sort_values(by='Price Diff (%)', ascending=False, inplace=True)
+    table['Rank'] = range(1, len(table) + 1)
+    return table
+
+
+_worker_matcher = None
+
+
+def _init_worker(df_sold):
+    global _worker_matcher
+    _worker_matcher = CompMatcher(df_sold)
+
+
+def _match_shard(args):
+    df_shard, criteria, valuation = args
+    return comp_results(_worker_matcher.match(df_shard, *criteria), valuation)
+
+
+def scan(df_active, df_sold, criteria, workers=1, valuation=None):
+    # criteria: (same_zip, same_county, same_city, same_sub, same_beds, sf_range)
+    if workers <= 1 or len(df_active) < 2:
+        return comp_results(CompMatcher(df_sold).match(df_active, *criteria), valuation)
+    shards = np.array_split(np.arange(len(df_active)), workers * 4)
+    jobs = [(df_active.iloc[shard], criteria, valuation) for shard in shards if len(shard)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(df_sold,)) as pool:
+        return pd.concat(list(pool.map(_match_shard, jobs)), ignore_index=True)
+
+
+# ===================== COMMAND LINE =====================
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Rank flip candidates from MLS Listings/Comps CSV exports.")
+    parser.add_argument("listings", help="Listings CSV")
+    parser.add_argument("comps", nargs="?", help="Comps CSV (omit with --store)")
+    parser.add_argument("--store", help="Read comps from a local comps store directory instead of a CSV")
+    parser.add_argument("--sort", choices=SORT_OPTIONS, default="ALL", help="Summary grouping")
+    parser.add_argument("--focus", nargs="+", help="Only rank listings whose --sort value is one of these")
+    parser.add_argument("--same-zip", action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument("--same-county", action=argparse.BooleanOptionalAction, default=False)
+    parser.add_argument("--same-city", action=argparse.BooleanOptionalAction, default=False)
+    parser.add_argument("--same-sub", action=argparse.BooleanOptionalAction, default=False)
+    parser.add_argument("--same-beds", action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument("--sf-range", type=int, default=15, help="± SF range (%%)")
+    parser.add_argument("--within-miles", type=float,
+                        help="Match comps by distance instead of ZIP/County/City/Sub (needs coordinates)")
+    parser.add_argument("--nearest", type=int, default=0, help="With --within-miles, keep only the K nearest comps")
+    parser.add_argument("--zip-centroids", default=ZIP_CENTROIDS_FILE,
+                        help="CSV of Zip, Latitude, Longitude for rows without coordinates")
+    parser.add_argument("--estimate", choices=list(ESTIMATES), default="mean", help="How comps are turned into a comp price")
+    parser.add_argument("--max-age-days", type=int, help="Ignore comps that closed longer ago than this")
+    parser.add_argument("--half-life-days", type=int, help="Weight comps by recency with this half-life")
+    parser.add_argument("--details", type=int, default=10, help="Top N candidates written to the Flip Details sheet")
+    parser.add_argument("--workers", type=int, default=1, help="Processes to shard active listings across")
+    parser.add_argument("--out-dir", default=".", help="Directory for the ranked CSV and Excel workbook")
+    parser.add_argument("--trace-memory", action="store_true", help="Record peak traced memory per stage")
+    args = parser.parse_args(argv)
+    if not args.comps and not args.store:
+        parser.error("a Comps CSV or --store is required")
+    if args.focus and args.sort == "ALL":
+        parser.error("--focus needs --sort other than ALL")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    perf = StageTimer(trace_memory=args.trace_memory, listings=os.path.basename(args.listings),
+                      comps=args.store or os.path.basename(args.comps))
+    with perf.stage('ingest_listings') as stage:
+        df_listings, listings_status_col, df_active = load_mls_file(args.listings, 'active')
+        stage['rows'] = len(df_listings)
+    with perf.stage('ingest_comps') as stage:
+        if args.store:
+            df_comps = df_sold = CompsStore(args.store).load_sold()
+            comps_status_col = find_status_column(df_sold)
+        else:
+            df_comps, comps_status_col, df_sold = load_mls_file(args.comps, 'sold')
+        stage['rows'] = len(df_comps)
+    if listings_status_col is None or comps_status_col is None:
+        raise SystemExit("Couldn't find a status column in one of the files.")
+
+    with perf.stage('summary', rows=len(df_active) + len(df_sold)):
+        summary = summarize(df_active, df_sold, args.sort)
+    df_focus = df_active
+    if args.focus:
+        df_focus = df_active[df_active[args.sort].astype(str).isin(args.focus)]
+    criteria = (args.same_zip, args.same_county, args.same_city, args.same_sub, args.same_beds, args.sf_range)
+    geo = None
+    valuation = Valuation(args.estimate, args.max_age_days, args.half_life_days)
+    with perf.stage('comp_matching', rows=len(df_focus)):
+        if args.within_miles:
+            geo = GeoCriteria(args.within_miles, args.nearest, args.same_beds, args.sf_range)
+            geo_matcher = GeoMatcher(df_sold, load_zip_centroids(args.zip_centroids))
+            results = comp_results(geo_matcher.match(df_focus, *geo), valuation)
+        else:
+            results = scan(df_focus, df_sold, criteria, args.workers, valuation)
+    with perf.stage('candidate_ranking', rows=len(df_focus)):
+        ranked = rank_candidates(df_focus, results)
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    filename = export_filename()
+    csv_path = os.path.join(args.out_dir, filename.replace('.xlsx', '_ranked.csv'))
+    xlsx_path = os.path.join(args.out_dir, filename)
+    with perf.stage('csv_export', rows=len(ranked)):
+        ranked.to_csv(csv_path, index=False)
+    with perf.stage('excel_export', rows=len(ranked)):
+        top = ranked.index[:args.details].to_numpy()
+        if geo is not None:
+            detail_matches = geo_matcher.match(df_focus.iloc[top], *geo)
+        else:
+            detail_matches = CompMatcher(df_sold).match(df_focus.iloc[top], *criteria)
+        details = ((df_focus.iloc[top[i]], detail_matches.comps(i)) for i in range(len(top)))
+        write_workbook(xlsx_path, summary, ranked, details, criteria_frame(*criteria, args.sort, args.focus, geo, valuation))
+    print(f"Ranked {len(ranked)} active listings against {len(df_sold)} sold comps")
+    print(f"Wrote {csv_path}")
+    print(f"Wrote {xlsx_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,116 @@
 import streamlit as st
 import pandas as pd
-import urllib.parse
-from io import BytesIO
-from datetime import datetime
+from analysis import SORT_OPTIONS
+from export import (ACTIVE_COLS, COMPS_COLS, DATE_COLS, MONEY_COLS, PERCENT_COLS, XLSX_MIME, criteria_frame, export_filename, workbook_file,
+                    zillow_search_url, zillow_search_urls)
+from ingest import content_hash, datasets, load_mls_csv
+from geo import GeoCriteria
+from jobs import unwatch_job, watch_job
+from perf import StageTimer
+from pipeline import criteria_key, focus_key, get_pipeline, pipelines
+from shared import SessionLease
+from valuation import ESTIMATES, Valuation
+from store import CompsStore
 
 st.set_page_config(page_title="Flip Analyzer", layout="wide")
 st.markdown("<h1 style='text-align: center; color: teal;'>🏠 NewRoof Real Estate Analyzer </h1>", unsafe_allow_html=True)
 
-sort_options = ["ALL", "Area", "County", "City", "Sub"]
+COMPS_PAGE_SIZE = 25
+JOB_WAIT_SECONDS = 0.5  # runs that finish this fast render without a progress bar
 
-def zillow_search_url(address):
-    if pd.isna(address):
-        return ""
-    address_url = urllib.parse.quote(str(address).replace(" ", "-"))
-    return f"https://www.zillow.com/homes/{address_url}_rb/"
+def column_formats(df):
+    # Display formats for money/percent/date columns; the frames themselves stay typed
+    # so st.dataframe sorts them as numbers and dates.
+    config = {col: st.column_config.NumberColumn(format="%,d") for col in MONEY_COLS if col in df.columns}
+    config.update({col: st.column_config.NumberColumn(format="%.1f%%") for col in PERCENT_COLS if col in df.columns})
+    config.update({col: st.column_config.DateColumn(format="MM/DD/YYYY") for col in DATE_COLS if col in df.columns})
+    return config
+
+def show_flip_details(selected_mls, df_view, mls_positions, matches, ranked, key):
+    # Only one selected listing is rendered at a time, and its comps one page at a time.
+    mls = st.selectbox("Show flip details for MLS #:", selected_mls, key=f"{key}_detail_mls")
+    i = mls_positions[str(mls)]
+    active_row = df_view.iloc[i]
+    st.markdown("---")
+    st.markdown(
+        f"📌 Flip Details: MLS {mls} "
+        f"<a href='{zillow_search_url(active_row['Address'])}' target='_blank' "
+        f"style='text-decoration:none;'>"
+        f"<button style='background:#0074e4;border:none;color:white;border-radius:3px;padding:1px 6px;font-size:85%;margin-left:3px;'>Zillow Search</button></a>",
+        unsafe_allow_html=True
+    )
+    active_display = pd.DataFrame([active_row[ACTIVE_COLS]])
+    st.dataframe(active_display, use_container_width=True, column_config=column_formats(active_display))
+
+    num_comps = int(matches.num_comps[i])
+    valued = int(ranked.at[i, '# of Comps'])  # ranked is indexed by listing position
+    st.markdown(f"**Matching Comps:** {num_comps}" + (f" ({valued} inside the valuation window)" if valued != num_comps else ""))
+    n_pages = max(1, -(-num_comps // COMPS_PAGE_SIZE))
+    page = 1
+    if n_pages > 1:
+        page = st.number_input(f"Comps page (1-{n_pages}):", min_value=1, max_value=n_pages, value=1, step=1, key=f"{key}_comps_page_{mls}")
+    start = (page - 1) * COMPS_PAGE_SIZE
+    comps = matches.comps(i, start, start + COMPS_PAGE_SIZE)
+    valid_cols = [col for col in COMPS_COLS + ['Distance (mi)'] if col in comps.columns]
+    comps_display = comps[valid_cols].copy()
+    comps_display['Zillow'] = zillow_search_urls(comps_display['Address']) if 'Address' in comps_display.columns else ""
+    st.dataframe(
+        comps_display,
+        use_container_width=True,
+        hide_index=True,
+        column_config={**column_formats(comps_display), "Zillow": st.column_config.LinkColumn("Zillow", display_text="Search")}
+    )
+
+def geo_controls(pipeline, same_beds, sf_range, key):
+    # Distance matching replaces the ZIP/County/City/Sub keys when coordinates exist.
+    if not pipeline.geo_available():
+        return None
+    if not st.checkbox("Match by distance instead of ZIP/County/City/Sub", key=f"{key}_geo"):
+        return None
+    within_miles = st.slider("Within (miles):", min_value=0.5, max_value=25.0, value=1.0, step=0.5, key=f"{key}_geo_miles")
+    nearest = st.number_input("Nearest comps (0 = all within range):", min_value=0, max_value=100, value=0, step=1, key=f"{key}_geo_nearest")
+    return GeoCriteria(within_miles, int(nearest), bool(same_beds), sf_range)
+
+def valuation_controls(key):
+    estimate = st.selectbox("Comp price estimate:", list(ESTIMATES), format_func=ESTIMATES.get, key=f"{key}_estimate")
+    max_age = st.number_input("Max comp age (days, 0 = any):", min_value=0, max_value=3650, value=0, step=30, key=f"{key}_max_age")
+    half_life = st.number_input("Recency half-life (days, 0 = no weighting):", min_value=0, max_value=3650, value=0, step=30, key=f"{key}_half_life")
+    return Valuation(estimate, int(max_age) or None, int(half_life) or None)
+
+def candidates_progress(pipeline, criteria, focus, sf_label, valuation, key, run_flag):
+    # Ranking runs as a background job shared by every session analysing the same data.
+    # Returns the ranked table once it is done; until then a fragment polls the job,
+    # showing progress and the table of the listings ranked so far, and reruns the page
+    # when it finishes.
+    job = watch_job(lease, f"{key}_job", pipeline, criteria, focus, sf_label, valuation)
+    if job.wait(JOB_WAIT_SECONDS):
+        if job.error is not None:
+            st.error(f"❌ Analysis failed: {job.error}")
+        elif st.session_state.get(f"{key}_job_reported") is not job:
+            perf.stages.extend(job.perf.stages)  # the job's own stages, once per session
+            st.session_state[f"{key}_job_reported"] = job
+        return job.result
+
+    @st.fragment(run_every=0.5)
+    def progress():
+        if job.finished:
+            st.rerun()
+        st.progress(job.progress, text=f"Matching comps: {job.done_rows:,} of {job.total:,} listings")
+        partial = job.partial
+        if partial is not None:
+            st.caption("Ranked so far:")
+            st.dataframe(partial, use_container_width=True, column_config=column_formats(partial))
+        if st.button("⏹️ Cancel", key=f"{key}_cancel"):
+            unwatch_job(lease, f"{key}_job")
+            st.session_state[run_flag] = False
+            st.rerun()
+
+    progress()
+    return None
+
+perf = StageTimer(trace_memory=st.session_state.get('perf_trace_memory', False))
+# Shared datasets and pipelines this session is using; released when the session ends.
+lease = st.session_state.setdefault('dataset_lease', SessionLease())
 
 col1, col2 = st.columns(2)
 with col1:
@@ -23,19 +120,49 @@ with col2:
 
 df_listings = None
 if listings_file:
-    df_listings = pd.read_csv(listings_file)
+    perf.context['listings'] = content_hash(listings_file)[:12]
+    with perf.stage('ingest_listings') as stage:
+        df_listings, listings_status_col, df_active = load_mls_csv(listings_file, 'active', lease)
+        stage['rows'] = len(df_listings)
     st.success(f"✅ Listings file uploaded successfully! Rows: {df_listings.shape[0]} | Columns: {df_listings.shape[1]}")
+else:
+    lease.drop('active')
+
+comps_store = CompsStore()
+use_comps_store = st.checkbox("Use local comps store instead of the uploaded Comps CSV", key="use_comps_store")
 
 df_comps = None
 if comps_file:
     try:
-        df_comps = pd.read_csv(comps_file)
+        perf.context['comps'] = content_hash(comps_file)[:12]
+        with perf.stage('ingest_comps') as stage:
+            df_comps, comps_status_col, df_sold = load_mls_csv(comps_file, 'sold', lease)
+            stage['rows'] = len(df_comps)
         st.success(f"✅ Comps file uploaded successfully! Rows: {df_comps.shape[0]} | Columns: {df_comps.shape[1]}")
     except pd.errors.EmptyDataError:
         df_comps = None
         st.error("❌ Comps file appears to be empty or invalid. Please upload a valid CSV.")
+    if df_comps is not None and st.button("➕ Append Comps CSV to local store"):
+        added = comps_store.append(df_comps)
+        st.success(f"✅ Appended {added} comps to local store ({comps_store.root}).")
+else:
+    lease.drop('sold')
+
+comps_ready = df_comps is not None
+comps_rows = len(df_comps) if comps_ready else 0
+if use_comps_store:
+    # Comps are read from the store partition by partition as the analysis needs them.
+    df_comps = df_sold = None
+    with perf.stage('load_comps_store') as stage:
+        comps_rows = stage['rows'] = comps_store.num_rows()
+        comps_status_col = comps_store.status_column()
+    comps_ready = comps_rows > 0
+    if not comps_ready:
+        st.warning("⚠️ Local comps store is empty. Upload a Comps CSV and append it first.")
+    else:
+        st.success(f"✅ Using local comps store! Rows: {comps_rows} | Partitions: {len(comps_store.partitions())}")
 
-sort_selection = st.selectbox("Sort listings by:", sort_options)
+sort_selection = st.selectbox("Sort listings by:", SORT_OPTIONS)
 sub_filter = None
 
 if 'run_clicked' not in st.session_state:
@@ -51,36 +178,21 @@ if st.button("▶️ Run Analysis"):
     st.session_state['run_clicked'] = True
     st.session_state['show_all_candidates'] = False
 
-if listings_file and comps_file and df_comps is not None and st.session_state['run_clicked']:
-    listings_status_col = [col for col in df_listings.columns if 'status' in col.lower()]
-    comps_status_col = [col for col in df_comps.columns if 'status' in col.lower()]
-    if not listings_status_col or not comps_status_col:
+if listings_file and comps_ready and st.session_state['run_clicked']:
+    if listings_status_col is None or comps_status_col is None:
         st.error("❌ Couldn't find a status column in one of the files.")
         st.stop()
-    listings_status_col = listings_status_col[0]
-    comps_status_col = comps_status_col[0]
-    df_listings[listings_status_col] = df_listings[listings_status_col].astype(str).str.strip().str.lower()
-    df_comps[comps_status_col] = df_comps[comps_status_col].astype(str).str.strip().str.lower()
-    df_active = df_listings[df_listings[listings_status_col] == 'active']
-    df_sold = df_comps[df_comps[comps_status_col] == 'sold']
+    if use_comps_store:
+        pipeline = get_pipeline((content_hash(listings_file), comps_store.root, comps_store.version()), df_active, df_sold, comps_store=comps_store, lease=lease)
+    else:
+        pipeline = get_pipeline((content_hash(listings_file), content_hash(comps_file)), df_active, df_sold, lease=lease)
 
     # ===================== "ALL" SORT =====================
     if sort_selection == "ALL":
-        summary = pd.DataFrame([{
-            'Listings_Count': df_active.shape[0],
-            'Sold_Count': df_sold.shape[0],
-            'Avg_List_Price': df_active['List Price'].mean(),
-            'Avg_Sold_Price': df_sold['Sale Price'].mean(),
-        }])
-        summary['Sold - List ($)'] = summary['Avg_Sold_Price'] - summary['Avg_List_Price']
-        summary['Sold - List (%)'] = ((summary['Avg_Sold_Price'] - summary['Avg_List_Price']) / summary['Avg_List_Price'].replace(0, pd.NA)) * 100
-        styled_summary = summary.copy()
-        styled_summary['Avg_List_Price'] = styled_summary['Avg_List_Price'].apply(lambda x: f"{int(x):,}" if pd.notna(x) else "")
-        styled_summary['Avg_Sold_Price'] = styled_summary['Avg_Sold_Price'].apply(lambda x: f"{int(x):,}" if pd.notna(x) else "")
-        styled_summary['Sold - List ($)'] = styled_summary['Sold - List ($)'].apply(lambda x: f"{int(x):,}" if pd.notna(x) else "")
-        styled_summary['Sold - List (%)'] = styled_summary['Sold - List (%)'].apply(lambda x: f"{x:.1f}%" if pd.notna(x) else "")
+        with perf.stage('summary', rows=len(df_active) + comps_rows):
+            summary = pipeline.summary(sort_selection)
         st.subheader("Summary by ALL")
-        st.dataframe(styled_summary, use_container_width=True)
+        st.dataframe(summary, use_container_width=True, column_config=column_formats(summary))
 
         st.markdown("### Comps Matching Criteria")
         same_zip = st.checkbox("Same ZIP", value=True, key="all_zip")
@@ -89,172 +201,55 @@ if listings_file and comps_file and df_comps is not None and st.session_state['r
         same_sub = st.checkbox("Same Sub", key="all_sub")
         same_beds = st.checkbox("Same # Bedrooms", value=True, key="all_beds")
         sf_range = st.slider("± SF Range (%):", min_value=5, max_value=50, value=15, step=5, key="all_sf")
+        geo = geo_controls(pipeline, same_beds, sf_range, key="all")
+        valuation = valuation_controls(key="all")
 
         if st.button("▶️ Show All Flip Candidates"):
             st.session_state['show_all_candidates'] = True
 
         if st.session_state.get('show_all_candidates', False):
+            all_flips_ranked = None
             if not df_active.empty:
-                all_rows = []
-                all_flips_dict = {}  # Store active row & comps by MLS #
-                for _, row in df_active.iterrows():
-                    listing_sf = row['Total Finished SF']
-                    sf_min = listing_sf * (1 - sf_range / 100)
-                    sf_max = listing_sf * (1 + sf_range / 100)
-                    comps_filtered = df_sold.copy()
-                    if same_zip:
-                        comps_filtered = comps_filtered[comps_filtered['Zip'].astype(str).str.strip() == str(row['Zip']).strip()]
-                    if same_county:
-                        comps_filtered = comps_filtered[comps_filtered['County'].astype(str).str.strip().str.lower() == str(row['County']).strip().lower()]
-                    if same_city:
-                        comps_filtered = comps_filtered[comps_filtered['City'].astype(str).str.strip().str.lower() == str(row['City']).strip().lower()]
-                    if same_sub:
-                        comps_filtered = comps_filtered[comps_filtered['Sub'].astype(str).str.strip().str.lower() == str(row['Sub']).strip().lower()]
-                    if same_beds:
-                        comps_filtered = comps_filtered[comps_filtered['Bedrooms'] == row['Bedrooms']]
-                    comps_filtered = comps_filtered[
-                        (comps_filtered['Total Finished SF'] >= sf_min) &
-                        (comps_filtered['Total Finished SF'] <= sf_max)
-                    ]
-                    avg_comp_price = comps_filtered['Sale Price'].mean() if not comps_filtered.empty else None
-                    num_comps = len(comps_filtered)
-                    price_diff = (avg_comp_price - row['List Price']) if avg_comp_price else None
-                    price_diff_pct = ((avg_comp_price - row['List Price']) / row['List Price'] * 100) if avg_comp_price else None
-                    all_rows.append({
-                        'Rank': 0,
-                        'MLS #': str(row['MLS #']),
-                        'Address': row['Address'],
-                        'Bedrooms': row['Bedrooms'],
-                        'Total Finished SF': row['Total Finished SF'],
-                        'List Price': row['List Price'],
-                        'Avg Comp Price': avg_comp_price,
-                        'Price Diff ($)': price_diff,
-                        'Price Diff (%)': price_diff_pct,
-                        '# of Comps': num_comps
-                    })
-                    all_flips_dict[str(row['MLS #'])] = {
-                        'active': row,
-                        'comps': comps_filtered.copy()
-                    }
-                all_flips_table = pd.DataFrame(all_rows)
-                all_flips_table.sort_values(by='Price Diff (%)', ascending=False, inplace=True)
-                all_flips_table['Rank'] = range(1, len(all_flips_table) + 1)
-                all_flips_table['List Price'] = all_flips_table['List Price'].apply(lambda x: f"{int(x):,}" if pd.notna(x) else "")
-                all_flips_table['Avg Comp Price'] = all_flips_table['Avg Comp Price'].apply(lambda x: f"{int(x):,}" if pd.notna(x) else "")
-                all_flips_table['Price Diff ($)'] = all_flips_table['Price Diff ($)'].apply(lambda x: f"{int(x):,}" if pd.notna(x) else "")
-                all_flips_table['Price Diff (%)'] = all_flips_table['Price Diff (%)'].apply(lambda x: f"{x:.1f}%" if pd.notna(x) else "")
-                st.dataframe(all_flips_table, use_container_width=True)
-
-                mls_plain_list = [row['MLS #'] for row in all_rows]
+                criteria = geo or criteria_key(same_zip, same_county, same_city, same_sub, same_beds, sf_range)
+                all_flips_ranked = candidates_progress(pipeline, criteria, None, 'Total Finished SF', valuation,
+                                                       key="all", run_flag='show_all_candidates')
+            if all_flips_ranked is not None:
+                matches = pipeline.matches(criteria)  # cached by the job
+                all_flips_dict = pipeline.mls_positions()  # MLS # -> listing position
+                with perf.stage('render_candidates', rows=len(all_flips_ranked)):
+                    st.dataframe(all_flips_ranked, use_container_width=True, column_config=column_formats(all_flips_ranked))
+
+                mls_plain_list = df_active['MLS #'].astype(str).tolist()
                 selected_mls = st.multiselect("Select MLS #(s) to focus on:", mls_plain_list)
                 if selected_mls:
                     st.write(f"You selected to focus on MLS #: {', '.join(map(str, selected_mls))}")
-                    for mls in selected_mls:
-                        active_row = all_flips_dict[str(mls)]['active']
-                        comps = all_flips_dict[str(mls)]['comps']
-                        st.markdown("---")
-                        st.markdown(
-                            f"📌 Flip Details: MLS {mls} "
-                            f"<a href='{zillow_search_url(active_row['Address'])}' target='_blank' "
-                            f"style='text-decoration:none;'>"
-                            f"<button style='background:#0074e4;border:none;color:white;border-radius:3px;padding:1px 6px;font-size:85%;margin-left:3px;'>Zillow Search</button></a>",
-                            unsafe_allow_html=True
-                        )
-                        active_cols = ['MLS #', 'Status', 'Area', 'Address', 'County', 'City', 'Zip', 'Sub', 'Bedrooms', 'Full Baths', 'Total Finished SF', 'List Price', 'List Dt']
-                        active_display = pd.DataFrame([active_row[active_cols]])
-                        st.dataframe(active_display, use_container_width=True)
-                        st.markdown("**Matching Comps:**")
-                        comps_cols = ['MLS #', 'Status', 'Area', 'Address', 'County', 'City', 'Zip', 'Sub', 'Bedrooms', 'Full Baths', 'Total Finished SF', 'Sale Price', 'Close Dt']
-                        valid_cols = [col for col in comps_cols if col in comps.columns]
-                        if len(valid_cols) > 0 and not comps.empty:
-                            comps_display = comps[valid_cols].copy()
-                            comps_display['Zillow'] = comps_display['Address'].apply(
-                                lambda addr: f"<a href='{zillow_search_url(addr)}' target='_blank'><button style='background:#0074e4;border:none;color:white;border-radius:3px;padding:1px 6px;font-size:85%;'>Search</button></a>" if pd.notna(addr) else ""
-                            )
-                        else:
-                            comps_display = pd.DataFrame(columns=comps_cols + ['Zillow'])
-                        st.markdown(comps_display.to_html(index=False, escape=False), unsafe_allow_html=True)
-                    
+                    with perf.stage('flip_details', rows=len(selected_mls)):
+                        show_flip_details(selected_mls, df_active, all_flips_dict, matches, all_flips_ranked, key="all")
+
                     # EXPORT TO EXCEL
                     if st.button("⬇️ Export to Excel", key="export_all"):
-                        output = BytesIO()
-                        summary_df = styled_summary.copy()
-                        focused_df = all_flips_table.copy()
-                        details_rows = []
-                        for mls in selected_mls:
-                            active_row = all_flips_dict[str(mls)]['active']
-                            comps = all_flips_dict[str(mls)]['comps']
-                            active_cols = ['MLS #', 'Status', 'Area', 'Address', 'County', 'City', 'Zip', 'Sub',
-                                           'Bedrooms', 'Full Baths', 'Total Finished SF', 'List Price', 'List Dt']
-                            flip_detail_row = pd.DataFrame([active_row[active_cols]])
-                            flip_detail_row['Zillow'] = f'=HYPERLINK("{zillow_search_url(active_row["Address"])}", "Zillow")'
-                            details_rows.append(flip_detail_row)
-                            comps_cols = ['MLS #', 'Status', 'Area', 'Address', 'County', 'City', 'Zip', 'Sub',
-                                          'Bedrooms', 'Full Baths', 'Total Finished SF', 'Sale Price', 'Close Dt']
-                            if not comps.empty:
-                                comps_export = comps[comps_cols].copy()
-                                comps_export['Zillow'] = comps_export['Address'].apply(
-                                    lambda addr: f'=HYPERLINK("{zillow_search_url(addr)}", "Zillow")' if pd.notna(addr) else ""
-                                )
-                                details_rows.append(comps_export)
-                            else:
-                                empty_df = pd.DataFrame(columns=comps_cols + ['Zillow'])
-                                details_rows.append(empty_df)
-                            divider = pd.DataFrame([["----"] * (len(active_cols) + 1)], columns=active_cols + ['Zillow'])
-                            details_rows.append(divider)
-                        flip_details_export = pd.concat(details_rows, ignore_index=True)
-                        criteria_dict = {
-                            "Same ZIP": [same_zip],
-                            "Same County": [same_county],
-                            "Same City": [same_city],
-                            "Same Sub": [same_sub],
-                            "Same # Bedrooms": [same_beds],
-                            "SF Range (%)": [sf_range],
-                            "Sort selection": [sort_selection],
-                            "Sub filter": [sub_filter if sub_filter else None],
-                        }
-                        criteria_df = pd.DataFrame(criteria_dict)
-                        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-                            summary_df.to_excel(writer, sheet_name='Summary', index=False)
-                            focused_df.to_excel(writer, sheet_name='Focused Area', index=False)
-                            flip_details_export.to_excel(writer, sheet_name='Flip Details', index=False)
-                            criteria_df.to_excel(writer, sheet_name='Comps Criteria', index=False)
-                        nowstr = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-                        filename = f"flip_analysis_{nowstr}.xlsx"
+                        details = ((df_active.iloc[all_flips_dict[str(mls)]], matches.comps(all_flips_dict[str(mls)])) for mls in selected_mls)
+                        criteria_df = criteria_frame(same_zip, same_county, same_city, same_sub, same_beds, sf_range, sort_selection, sub_filter, geo, valuation)
+                        with perf.stage('excel_export', rows=len(all_flips_ranked)):
+                            output = workbook_file(summary, all_flips_ranked, details, criteria_df)
+                        filename = export_filename()
                         st.download_button(
                             label=f"Download Excel ({filename})",
-                            data=output.getvalue(),
+                            data=output,
                             file_name=filename,
-                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                            mime=XLSX_MIME
                         )
+                        output.close()
             if st.button("🔄 Reset Candidates View"):
                 st.session_state['show_all_candidates'] = False
+                unwatch_job(lease, "all_job")
 
     # ================== BY AREA SORT ==================
     elif sort_selection in df_listings.columns:
-        group_active = df_active.groupby(sort_selection)
-        group_sold = df_sold.groupby(sort_selection)
-        summary_active = group_active.agg(
-            Listings_Count=('MLS #', 'count'),
-            Avg_List_Price=('List Price', 'mean')
-        )
-        summary_sold = group_sold.agg(
-            Sold_Count=('MLS #', 'count'),
-            Avg_Sold_Price=('Sale Price', lambda x: x.dropna().mean())
-        )
-        summary = summary_active.join(summary_sold, how='outer').reset_index()
-        summary.fillna({'Sold_Count': 0, 'Avg_Sold_Price': 0}, inplace=True)
-        summary['Sold - List ($)'] = summary['Avg_Sold_Price'] - summary['Avg_List_Price']
-        summary['Sold - List (%)'] = ((summary['Avg_Sold_Price'] - summary['Avg_List_Price']) / summary['Avg_List_Price'].replace(0, pd.NA)) * 100
-        summary = summary.sort_values(by='Listings_Count', ascending=False)
-        styled_summary = summary.copy()
-        styled_summary[sort_selection] = summary[sort_selection]
-        styled_summary['Avg_List_Price'] = styled_summary['Avg_List_Price'].apply(lambda x: f"{int(x):,}" if pd.notna(x) else "")
-        styled_summary['Avg_Sold_Price'] = styled_summary['Avg_Sold_Price'].apply(lambda x: f"{int(x):,}" if pd.notna(x) else "")
-        styled_summary['Sold - List ($)'] = styled_summary['Sold - List ($)'].apply(lambda x: f"{int(x):,}" if pd.notna(x) else "")
-        styled_summary['Sold - List (%)'] = styled_summary['Sold - List (%)'].apply(lambda x: f"{x:.1f}%" if pd.notna(x) else "")
+        with perf.stage('summary', rows=len(df_active) + comps_rows):
+            summary = pipeline.summary(sort_selection)
         st.subheader(f"Summary by {sort_selection}")
-        st.dataframe(styled_summary, use_container_width=True)
+        st.dataframe(summary, use_container_width=True, column_config=column_formats(summary))
 
         sub_options = sorted(df_listings[sort_selection].dropna().unique().astype(str).tolist())
         sub_filter = st.multiselect(f"Select {sort_selection}(s) to focus on:", sub_options)
@@ -265,147 +260,59 @@ if listings_file and comps_file and df_comps is not None and st.session_state['r
         same_sub = st.checkbox("Same Sub")
         same_beds = st.checkbox("Same # Bedrooms", value=True)
         sf_range = st.slider("± SF Range (%):", min_value=5, max_value=50, value=15, step=5)
+        geo = geo_controls(pipeline, same_beds, sf_range, key="focus")
+        valuation = valuation_controls(key="focus")
 
         if st.button("▶️ Run Focused Area Analysis"):
             st.session_state['area_run_clicked'] = True
 
         if sub_filter and st.session_state.get('area_run_clicked', False):
-            df_focus = df_active[df_active[sort_selection].astype(str).isin(sub_filter)].copy()
-            focus_rows = []
-            focus_comps_dict = {}
-            for _, row in df_focus.iterrows():
-                listing_sf = row['Total Finished SF']
-                sf_min = listing_sf * (1 - sf_range / 100)
-                sf_max = listing_sf * (1 + sf_range / 100)
-                comps_filtered = df_sold.copy()
-                if same_zip:
-                    comps_filtered = comps_filtered[comps_filtered['Zip'].astype(str).str.strip() == str(row['Zip']).strip()]
-                if same_county:
-                    comps_filtered = comps_filtered[comps_filtered['County'].astype(str).str.strip().str.lower() == str(row['County']).strip().lower()]
-                if same_city:
-                    comps_filtered = comps_filtered[comps_filtered['City'].astype(str).str.strip().str.lower() == str(row['City']).strip().lower()]
-                if same_sub:
-                    comps_filtered = comps_filtered[comps_filtered['Sub'].astype(str).str.strip().str.lower() == str(row['Sub']).strip().lower()]
-                if same_beds:
-                    comps_filtered = comps_filtered[comps_filtered['Bedrooms'] == row['Bedrooms']]
-                comps_filtered = comps_filtered[
-                    (comps_filtered['Total Finished SF'] >= sf_min) &
-                    (comps_filtered['Total Finished SF'] <= sf_max)
-                ]
-                avg_comp_price = comps_filtered['Sale Price'].mean() if not comps_filtered.empty else None
-                num_comps = len(comps_filtered)
-                price_diff = (avg_comp_price - row['List Price']) if avg_comp_price else None
-                price_diff_pct = ((avg_comp_price - row['List Price']) / row['List Price'] * 100) if avg_comp_price else None
-                focus_rows.append({
-                    'Rank': 0,
-                    'MLS #': str(row['MLS #']),
-                    'Address': row['Address'],
-                    'Bedrooms': row['Bedrooms'],
-                    'SF': row['Total Finished SF'],
-                    'List Price': row['List Price'],
-                    'Avg Comp Price': avg_comp_price,
-                    'Price Diff ($)': price_diff,
-                    'Price Diff (%)': price_diff_pct,
-                    '# of Comps': num_comps
-                })
-                focus_comps_dict[str(row['MLS #'])] = {
-                    'active': row,
-                    'comps': comps_filtered.copy()
-                }
-            if focus_rows:
-                df_focus_table = pd.DataFrame(focus_rows)
-                df_focus_table.sort_values(by='Price Diff (%)', ascending=False, inplace=True)
-                df_focus_table['Rank'] = range(1, len(df_focus_table) + 1)
-                cols = df_focus_table.columns.tolist()
-                reordered = ['Rank'] + [col for col in cols if col != 'Rank']
-                df_focus_table = df_focus_table[reordered]
-                df_focus_table['List Price'] = df_focus_table['List Price'].apply(lambda x: f"{int(x):,}" if pd.notna(x) else "")
-                df_focus_table['Avg Comp Price'] = df_focus_table['Avg Comp Price'].apply(lambda x: f"{int(x):,}" if pd.notna(x) else "")
-                df_focus_table['Price Diff ($)'] = df_focus_table['Price Diff ($)'].apply(lambda x: f"{int(x):,}" if pd.notna(x) else "")
-                df_focus_table['Price Diff (%)'] = df_focus_table['Price Diff (%)'].apply(lambda x: f"{x:.1f}%" if pd.notna(x) else "")
-                st.dataframe(df_focus_table, use_container_width=True)
-
-                mls_plain_list = df_focus_table['MLS #'].tolist()
+            focus = focus_key(sort_selection, sub_filter)
+            criteria = geo or criteria_key(same_zip, same_county, same_city, same_sub, same_beds, sf_range)
+            df_focus = pipeline.listings(focus)
+            focus_comps_dict = pipeline.mls_positions(focus)  # MLS # -> listing position
+            df_focus_ranked = None
+            if not df_focus.empty:
+                df_focus_ranked = candidates_progress(pipeline, criteria, focus, 'SF', valuation,
+                                                      key="focus", run_flag='area_run_clicked')
+            else:
+                st.warning(f"No listings found in {sub_filter}.")
+            if df_focus_ranked is not None:
+                matches = pipeline.matches(criteria, focus)  # cached by the job
+                with perf.stage('render_candidates', rows=len(df_focus_ranked)):
+                    st.dataframe(df_focus_ranked, use_container_width=True, column_config=column_formats(df_focus_ranked))
+
+                mls_plain_list = df_focus_ranked['MLS #'].tolist()
                 selected_mls = st.multiselect("Select MLS #(s) to focus on:", mls_plain_list)
                 if selected_mls:
                     st.session_state['focus_flips_selected'] = True
                     st.write(f"You selected to focus on MLS #: {', '.join(map(str, selected_mls))}")
-                    for mls in selected_mls:
-                        active_row = focus_comps_dict[str(mls)]['active']
-                        comps = focus_comps_dict[str(mls)]['comps']
-                        st.markdown("---")
-                        st.markdown(
-                            f"📌 Flip Details: MLS {mls} "
-                            f"<a href='{zillow_search_url(active_row['Address'])}' target='_blank' "
-                            f"style='text-decoration:none;'>"
-                            f"<button style='background:#0074e4;border:none;color:white;border-radius:3px;padding:1px 6px;font-size:85%;margin-left:3px;'>Zillow Search</button></a>",
-                            unsafe_allow_html=True
-                        )
-                        active_cols = ['MLS #', 'Status', 'Area', 'Address', 'County', 'City', 'Zip', 'Sub', 'Bedrooms', 'Full Baths', 'Total Finished SF', 'List Price', 'List Dt']
-                        active_display = pd.DataFrame([active_row[active_cols]])
-                        st.dataframe(active_display, use_container_width=True)
-                        st.markdown("**Matching Comps:**")
-                        comps_cols = ['MLS #', 'Status', 'Area', 'Address', 'County', 'City', 'Zip', 'Sub', 'Bedrooms', 'Full Baths', 'Total Finished SF', 'Sale Price', 'Close Dt']
-                        valid_cols = [col for col in comps_cols if col in comps.columns]
-                        if len(valid_cols) > 0 and not comps.empty:
-                            comps_display = comps[valid_cols].copy()
-                            comps_display['Zillow'] = comps_display['Address'].apply(
-                                lambda addr: f"<a href='{zillow_search_url(addr)}' target='_blank'><button style='background:#0074e4;border:none;color:white;border-radius:3px;padding:1px 6px;font-size:85%;'>Search</button></a>" if pd.notna(addr) else ""
-                            )
-                        else:
-                            comps_display = pd.DataFrame(columns=comps_cols + ['Zillow'])
-                        st.markdown(comps_display.to_html(index=False, escape=False), unsafe_allow_html=True)
+                    with perf.stage('flip_details', rows=len(selected_mls)):
+                        show_flip_details(selected_mls, df_focus, focus_comps_dict, matches, df_focus_ranked, key="focus")
 
                     if st.button("⬇️ Export to Excel", key="export_focus"):
-                        output = BytesIO()
-                        summary_df = styled_summary.copy()
-                        focused_df = df_focus_table.copy()
-                        details_rows = []
-                        for mls in selected_mls:
-                            active_row = focus_comps_dict[str(mls)]['active']
-                            comps = focus_comps_dict[str(mls)]['comps']
-                            active_cols = ['MLS #', 'Status', 'Area', 'Address', 'County', 'City', 'Zip', 'Sub',
-                                           'Bedrooms', 'Full Baths', 'Total Finished SF', 'List Price', 'List Dt']
-                            flip_detail_row = pd.DataFrame([active_row[active_cols]])
-                            flip_detail_row['Zillow'] = f'=HYPERLINK("{zillow_search_url(active_row["Address"])}", "Zillow")'
-                            details_rows.append(flip_detail_row)
-                            comps_cols = ['MLS #', 'Status', 'Area', 'Address', 'County', 'City', 'Zip', 'Sub',
-                                          'Bedrooms', 'Full Baths', 'Total Finished SF', 'Sale Price', 'Close Dt']
-                            if not comps.empty:
-                                comps_export = comps[comps_cols].copy()
-                                comps_export['Zillow'] = comps_export['Address'].apply(
-                                    lambda addr: f'=HYPERLINK("{zillow_search_url(addr)}", "Zillow")' if pd.notna(addr) else ""
-                                )
-                                details_rows.append(comps_export)
-                            else:
-                                empty_df = pd.DataFrame(columns=comps_cols + ['Zillow'])
-                                details_rows.append(empty_df)
-                            divider = pd.DataFrame([["----"] * (len(active_cols) + 1)], columns=active_cols + ['Zillow'])
-                            details_rows.append(divider)
-                        flip_details_export = pd.concat(details_rows, ignore_index=True)
-                        criteria_dict = {
-                            "Same ZIP": [same_zip],
-                            "Same County": [same_county],
-                            "Same City": [same_city],
-                            "Same Sub": [same_sub],
-                            "Same # Bedrooms": [same_beds],
-                            "SF Range (%)": [sf_range],
-                            "Sort selection": [sort_selection],
-                            "Sub filter": [sub_filter if sub_filter else None],
-                        }
-                        criteria_df = pd.DataFrame(criteria_dict)
-                        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-                            summary_df.to_excel(writer, sheet_name='Summary', index=False)
-                            focused_df.to_excel(writer, sheet_name='Focused Area', index=False)
-                            flip_details_export.to_excel(writer, sheet_name='Flip Details', index=False)
-                            criteria_df.to_excel(writer, sheet_name='Comps Criteria', index=False)
-                        nowstr = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-                        filename = f"flip_analysis_{nowstr}.xlsx"
+                        details = ((df_focus.iloc[focus_comps_dict[str(mls)]], matches.comps(focus_comps_dict[str(mls)])) for mls in selected_mls)
+                        criteria_df = criteria_frame(same_zip, same_county, same_city, same_sub, same_beds, sf_range, sort_selection, sub_filter, geo, valuation)
+                        with perf.stage('excel_export', rows=len(df_focus_ranked)):
+                            output = workbook_file(summary, df_focus_ranked, details, criteria_df)
+                        filename = export_filename()
                         st.download_button(
                             label=f"Download Excel ({filename})",
-                            data=output.getvalue(),
+                            data=output,
                             file_name=filename,
-                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                            mime=XLSX_MIME
                         )
-            else:
-                st.warning(f"No listings found in {sub_filter}.")
+                        output.close()
+
+# ===================== PERFORMANCE =====================
+with st.expander("⏱️ Performance"):
+    st.checkbox("Track peak memory (slower)", key="perf_trace_memory")
+    if perf.stages:
+        st.dataframe(perf.frame(), use_container_width=True, hide_index=True)
+        st.caption(f"Run {perf.context['run']} · total {sum(s['seconds'] for s in perf.stages):.3f}s · "
+                   f"stages are also logged as JSON on the 'flips.perf' logger")
+    else:
+        st.caption("No stages ran in this rerun.")
+    shared_datasets, shared_pipelines = datasets.stats(), pipelines.stats()
+    st.caption(f"Shared across sessions: {shared_datasets['entries']} datasets ({shared_datasets['held']} in use), "
+               f"{shared_pipelines['entries']} analyses ({shared_pipelines['held']} in use)")
@@ -0,0 +1,211 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from analysis import comp_results, rank_candidates, summarize
+from comps import CompMatcher
+from export import criteria_frame, write_workbook
+from ingest import read_mls_csv, split_status, stream_mls_csv
+from valuation import Valuation
+
+COUNTIES = ['Wake', 'Durham', 'Johnston', 'Chatham', 'Orange', 'Harnett', 'Franklin', 'Granville']
+CITIES = ['Raleigh', 'Cary', 'Apex', 'Durham', 'Wake Forest', 'Holly Springs', 'Garner', 'Fuquay Varina',
+          'Morrisville', 'Knightdale', 'Clayton', 'Chapel Hill']
+STREETS = ['Main St', 'Oak Dr', 'Pine Ln', 'Maple Ave', 'Cedar Ct', 'Elm St', 'Willow Way', 'Birch Rd']
+
+
+# ===================== SYNTHETIC DATA =====================
+# Zip, Sub and Area counts plus each Zip's $/SF. One market is shared by a listings file
+# and its comps file so both cover the same Zips, Subs and Areas.
+Market = namedtuple('Market', ['n_zips', 'n_subs', 'n_areas', 'zip_ppsf'])
+
+
+def generate_market(comps_rows, seed=0):
+    # Sized from the comps file so buckets stay realistically sized as it grows.
+    rng = np.random.default_rng(seed)
+    n_zips = int(np.clip(comps_rows // 400, 5, 900))
+    n_subs = int(np.clip(comps_rows // 40, 20, 20000))
+    n_areas = int(np.clip(n_zips // 5, 4, n_zips))
+    return Market(n_zips, n_subs, n_areas, rng.uniform(120, 320, n_zips))
+
+
+def generate_mls(n_rows, kind='comps', seed=0, market=None):
+    # Listings (kind='listings') or Comps (kind='comps') with the columns app.py reads.
+    if market is None:
+        market = generate_market(n_rows, seed)
+    rng = np.random.default_rng(seed + 1 if kind == 'comps' else seed + 2)
+    n_zips, n_subs = market.n_zips, market.n_subs
+
+    zip_ids = rng.integers(0, n_zips, n_rows)
+    zip_codes = 27000 + zip_ids
+    sub_ids = zip_ids * (n_subs // n_zips + 1) + rng.integers(0, n_subs // n_zips + 1, n_rows)
+    bedrooms = rng.choice([1, 2, 3, 4, 5, 6], n_rows, p=[.03, .15, .38, .3, .11, .03])
+    sf = np.round(rng.normal(550, 120, n_rows).clip(250, 1200) * bedrooms)
+    price = np.round(sf * market.zip_ppsf[zip_ids] * rng.normal(1, 0.12, n_rows), -3)
+    days = rng.integers(0, 3 * 365, n_rows)
+    dates = (pd.Timestamp('2024-01-01') - pd.to_timedelta(days, unit='D')).strftime('%m/%d/%Y')
+
+    if kind == 'listings':
+        statuses = rng.choice(['Active', 'active ', 'Pending', 'Active Under Contract'], n_rows, p=[.7, .1, .1, .1])
+        price_cols = {'List Price': price, 'List Dt': dates}
+    else:
+        statuses = rng.choice(['Sold', 'SOLD', 'Expired', 'Withdrawn'], n_rows, p=[.75, .1, .1, .05])
+        price_cols = {'Sale Price': price, 'Close Dt': dates}
+
+    df = pd.DataFrame({
+        'MLS #': (50_000_000 if kind == 'listings' else 10_000_000) + rng.permutation(n_rows),
+        'Status': statuses,
+        'Area': 'A' + pd.Series(zip_ids * market.n_areas // n_zips).astype(str),
+        'Address': pd.Series(rng.integers(100, 9999, n_rows)).astype(str) + ' ' + rng.choice(STREETS, n_rows),
+        'County': np.array(COUNTIES)[zip_ids % len(COUNTIES)],
+        'City': np.array(CITIES)[zip_ids % len(CITIES)],
+        'Zip': zip_codes,
+        'Sub': 'Sub ' + pd.Series(sub_ids).astype(str),
+        'Bedrooms': bedrooms,
+        'Full Baths': np.maximum(1, bedrooms - rng.integers(0, 2, n_rows)),
+        'Total Finished SF': sf,
+        **price_cols,
+    })
+    return df
+
+
+def write_dataset(directory, comps_rows, listings_rows, seed=0):
+    listings_path = os.path.join(directory, f'listings_{listings_rows}.csv')
+    comps_path = os.path.join(directory, f'comps_{comps_rows}.csv')
+    market = generate_market(comps_rows, seed)
+    generate_mls(listings_rows, 'listings', seed, market).to_csv(listings_path, index=False)
+    generate_mls(comps_rows, 'comps', seed, market).to_csv(comps_path, index=False)
+    return listings_path, comps_path
+
+
+# ===================== TIMING =====================
+def timed(stages, name, rows, func, trace_memory=True):
+    # tracemalloc slows Python-heavy stages down, so peak memory comes from a second pass.
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+    peak = None
+    if trace_memory:
+        tracemalloc.start()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    stages[name] = {
+        'seconds': round(seconds, 6),
+        'rows': int(rows),
+        'rows_per_sec': round(rows / seconds, 1) if seconds > 0 else None,
+        'peak_mb': round(peak / 2**20, 3) if peak is not None else None,
+    }
+    return result
+
+
+def run_size(data_dir, comps_rows, listings_rows, group_by='Area', details=20, seed=0, trace_memory=True):
+    listings_path, comps_path = write_dataset(data_dir, comps_rows, listings_rows, seed)
+    with open(listings_path, 'rb') as f:
+        listings_bytes = f.read()
+    with open(comps_path, 'rb') as f:
+        comps_bytes = f.read()
+
+    stages = {}
+
+    def timed_stage(name, rows, func):
+        return timed(stages, name, rows, func, trace_memory)
+
+    _, _, df_active = timed_stage('ingest_listings', listings_rows,
+                                  lambda: split_status(read_mls_csv(listings_bytes), 'active'))
+    _, _, df_sold = timed_stage('ingest_comps', comps_rows,
+                                lambda: split_status(read_mls_csv(comps_bytes), 'sold'))
+    timed_stage('ingest_comps_streamed', comps_rows, lambda: stream_mls_csv(comps_bytes, 'sold'))
+    summary = timed_stage('summary_all', len(df_active) + len(df_sold),
+                          lambda: summarize(df_active, df_sold, 'ALL'))
+    timed_stage('summary_grouped', len(df_active) + len(df_sold),
+                lambda: summarize(df_active, df_sold, group_by))
+
+    criteria = (True, False, False, False, True, 15)
+    matches = timed_stage('comp_matching', len(df_active),
+                          lambda: CompMatcher(df_sold).match(df_active, *criteria))
+    ranked = timed_stage('candidate_ranking', len(df_active),
+                         lambda: rank_candidates(df_active, comp_results(matches)))
+    timed_stage('comp_valuation', int(matches.num_comps.sum()),
+                lambda: comp_results(matches, Valuation('median', 365, 180)))
+
+    top = ranked.index[:details].to_numpy()
+    fd, xlsx_path = tempfile.mkstemp(suffix='.xlsx', dir=data_dir)
+    os.close(fd)
+    timed_stage('excel_export', len(ranked) + int(matches.num_comps[top].sum()),
+                lambda: write_workbook(xlsx_path, summary, ranked,
+                                       ((df_active.iloc[i], matches.comps(i)) for i in top),
+                                       criteria_frame(*criteria, 'ALL')))
+    os.remove(xlsx_path)
+
+    return {
+        'comps_rows': comps_rows,
+        'listings_rows': listings_rows,
+        'active_rows': len(df_active),
+        'sold_rows': len(df_sold),
+        'csv_mb': round((len(listings_bytes) + len(comps_bytes)) / 2**20, 3),
+        'stages': stages,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# ===================== COMMAND LINE =====================
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the flip analysis stages on synthetic MLS data.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000],
+                        help="Comps CSV sizes in rows (1k to 1M)")
+    parser.add_argument("--listings-ratio", type=float, default=0.1, help="Listings rows per comps row")
+    parser.add_argument("--group-by", default="Area", help="Column for the grouped summary")
+    parser.add_argument("--details", type=int, default=20, help="Candidates written to the Flip Details sheet")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc pass for peak memory")
+    parser.add_argument("--data-dir", help="Keep the generated CSVs here instead of a temporary directory")
+    parser.add_argument("--out", default="bench_results.json", help="JSON results file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = {
+        'revision': git_revision(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'runs': [],
+    }
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_dir = args.data_dir or tmp_dir
+        os.makedirs(data_dir, exist_ok=True)
+        for size in args.sizes:
+            listings_rows = max(1, int(size * args.listings_ratio))
+            run = run_size(data_dir, size, listings_rows, args.group_by, args.details, args.seed, not args.no_memory)
+            results['runs'].append(run)
+            total = sum(stage['seconds'] for stage in run['stages'].values())
+            print(f"{size:>9,} comps / {listings_rows:>8,} listings: {total:8.3f}s  " +
+                  "  ".join(f"{name}={stage['seconds']:.3f}s" for name, stage in run['stages'].items()))
+
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+KEY_COLUMNS = ['Zip', 'County', 'City', 'Sub', 'Bedrooms']
+MATCHES_PER_INDEX = 32
+
+
+def normalize_key(series, column):
+    # Same normalization the per-listing filters used: Zip is stripped, text keys are
+    # stripped and lower-cased, Bedrooms is compared as-is.
+    if column == 'Bedrooms':
+        return series
+    values = series.astype(str).str.strip()
+    if column != 'Zip':
+        values = values.str.lower()
+    return values
+
+
+def selected_keys(same_zip, same_county, same_city, same_sub, same_beds):
+    flags = [same_zip, same_county, same_city, same_sub, same_beds]
+    return [col for col, flag in zip(KEY_COLUMNS, flags) if flag]
+
+
+def close_dates(df_sold):
+    if 'Close Dt' not in df_sold.columns:
+        return np.full(len(df_sold), np.datetime64('NaT'), dtype='datetime64[ns]')
+    return pd.to_datetime(df_sold['Close Dt'], errors='coerce').to_numpy(dtype='datetime64[ns]')
+
+
+def latest_close(close_dt):
+    closed = close_dt[~np.isnat(close_dt)]
+    return closed.max() if len(closed) else np.datetime64('NaT')
+
+
+def expand_ranges(lo, hi):
+    # (owner, position) for every position in the ranges [lo[i], hi[i])
+    counts = hi - lo
+    owner = np.repeat(np.arange(len(lo)), counts)
+    return owner, np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(lo, counts)
+
+
+def mean_price(priced, price_sum):
+    # Mean Sale Price from the number of comps with a price and the sum of those prices.
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(priced > 0, price_sum / np.maximum(priced, 1), np.nan)
+
+
+def price_stats(df_active, num_comps, comp_price):
+    # (comp price, price diff, price diff %) per listing: no comp price without comps,
+    # and no diff when the comp price is 0.
+    with np.errstate(invalid='ignore', divide='ignore'):
+        avg_comp_price = np.where(num_comps > 0, comp_price, np.nan)
+        list_price = pd.to_numeric(df_active['List Price'], errors='coerce').to_numpy(dtype=float)
+        has_avg = (num_comps > 0) & (avg_comp_price != 0)
+        price_diff = np.where(has_avg, avg_comp_price - list_price, np.nan)
+        price_diff_pct = np.where(has_avg, price_diff / list_price * 100, np.nan)
+    return avg_comp_price, price_diff, price_diff_pct
+
+
+class SoldBuckets:
+    # Sold comps for one set of key columns, sorted by (key bucket, SF) with price prefix
+    # sums. Built from the sold side only, so any subset of listings can be matched
+    # against it later without rebuilding anything.
+
+    def __init__(self, matcher, columns):
+        self.matcher = matcher
+        self.df_sold = matcher.df_sold
+        self.columns = columns
+        n_sold = len(self.df_sold)
+        if columns:
+            keys = pd.DataFrame({col: matcher.key(col).astype(object) for col in columns})
+            codes = keys.groupby(columns, sort=False, dropna=True).ngroup()
+            codes = codes.fillna(-1).to_numpy(dtype=np.int64)
+            self.lookup = keys[codes >= 0].assign(_code=codes[codes >= 0]).drop_duplicates(columns)
+        else:
+            codes = np.zeros(n_sold, dtype=np.int64)
+            self.lookup = None
+
+        # SF is replaced by its rank among the sold SF values, so (bucket, SF) packs into
+        # one exact int64 key and a listing's window edges are found with searchsorted.
+        ok = (codes >= 0) & ~np.isnan(matcher.sf)
+        self.sf_values = np.unique(matcher.sf[ok])
+        self.width = len(self.sf_values) + 1
+        order = np.flatnonzero(ok)
+        sold_key = codes[order] * self.width + np.searchsorted(self.sf_values, matcher.sf[order])
+        sort_idx = np.argsort(sold_key, kind='stable')
+        self.order = order[sort_idx]
+        self.sold_key = sold_key[sort_idx]
+
+        prices = matcher.price[self.order]
+        has_price = ~np.isnan(prices)
+        self.price_sums = np.concatenate([[0.0], np.cumsum(np.where(has_price, prices, 0.0))])
+        self.price_counts = np.concatenate([[0], np.cumsum(has_price)])
+
+    def listing_codes(self, df_listings):
+        if not self.columns:
+            return np.zeros(len(df_listings), dtype=np.int64)
+        keys = pd.DataFrame({col: normalize_key(df_listings[col], col).to_numpy(dtype=object) for col in self.columns})
+        codes = keys.merge(self.lookup, how='left', on=self.columns)['_code']
+        return codes.fillna(-1).to_numpy(dtype=np.int64)
+
+    def windows(self, df_listings, sf_range):
+        codes = self.listing_codes(df_listings)
+        listing_sf = pd.to_numeric(df_listings['Total Finished SF'], errors='coerce').to_numpy(dtype=float)
+        ok = (codes >= 0) & ~np.isnan(listing_sf)
+        lo = np.zeros(len(df_listings), dtype=np.int64)
+        hi = np.zeros(len(df_listings), dtype=np.int64)
+        base = codes[ok] * self.width
+        sf_min = listing_sf[ok] * (1 - sf_range / 100)
+        sf_max = listing_sf[ok] * (1 + sf_range / 100)
+        lo[ok] = np.searchsorted(self.sold_key, base + np.searchsorted(self.sf_values, sf_min, side='left'), side='left')
+        hi[ok] = np.searchsorted(self.sold_key, base + np.searchsorted(self.sf_values, sf_max, side='right'), side='left')
+        return lo, np.maximum(hi, lo)
+
+
+class CompMatcher:
+    def __init__(self, df_sold):
+        self.df_sold = df_sold
+        self.sf = pd.to_numeric(df_sold['Total Finished SF'], errors='coerce').to_numpy(dtype=float)
+        self.price = pd.to_numeric(df_sold['Sale Price'], errors='coerce').to_numpy(dtype=float)
+        self.close_dt = close_dates(df_sold)
+        self._keys = {}
+        self._buckets = {}
+
+    def key(self, column):
+        if column not in self._keys:
+            self._keys[column] = normalize_key(self.df_sold[column], column).to_numpy()
+        return self._keys[column]
+
+    def buckets(self, columns):
+        # Shared by every SF range for the same key columns.
+        key = tuple(columns)
+        if key not in self._buckets:
+            self._buckets[key] = SoldBuckets(self, list(columns))
+        return self._buckets[key]
+
+    def match(self, df_active, same_zip=True, same_county=False, same_city=False,
+              same_sub=False, same_beds=True, sf_range=15):
+        buckets = self.buckets(selected_keys(same_zip, same_county, same_city, same_sub, same_beds))
+        lo, hi = buckets.windows(df_active, sf_range)
+        return CompMatches(buckets, df_active, lo, hi)
+
+
+class CompMatches:
+    def __init__(self, buckets, df_active, lo, hi):
+        self.buckets = buckets
+        self.matcher = buckets.matcher
+        self.df_active = df_active
+        self.lo = lo
+        self.hi = hi
+
+        self.num_comps = hi - lo
+        self.avg_comp_price, self.price_diff, self.price_diff_pct = price_stats(df_active, self.num_comps, mean_price(
+            buckets.price_counts[hi] - buckets.price_counts[lo], buckets.price_sums[hi] - buckets.price_sums[lo]))
+
+    def __len__(self):
+        return len(self.lo)
+
+    def positions(self, i):
+        return np.sort(self.buckets.order[self.lo[i]:self.hi[i]])
+
+    def pairs(self):
+        # (listing, sold row position) for every matched comp
+        listing, i = expand_ranges(self.lo, self.hi)
+        return listing, self.buckets.order[i]
+
+    def comps(self, i, start=None, stop=None):
+        return self.buckets.df_sold.iloc[self.positions(i)[start:stop]]
+
+
+class CompIndex:
+    # Per-listing comp windows for the active listings, filled in lazily per criteria
+    # combination: asking for a subset of rows only matches the rows not seen before.
+    # With a comps store, sold comps are loaded per (Same ZIP, Same County) pair so
+    # only the reachable partitions are read.
+
+    def __init__(self, df_active, df_sold=None, comps_store=None):
+        self.df_active = df_active
+        self.df_sold = df_sold
+        self.comps_store = comps_store
+        self._matchers = {}
+        self._windows = OrderedDict()  # criteria -> (buckets, lo, hi, done)
+        self._lock = threading.Lock()
+
+    def matcher(self, same_zip, same_county):
+        key = (same_zip, same_county) if self.comps_store is not None else None
+        if key not in self._matchers:
+            if self.comps_store is not None:
+                df_sold = self.comps_store.sold_for_listings(self.df_active, same_zip, same_county)
+            else:
+                df_sold = self.df_sold
+            self._matchers[key] = CompMatcher(df_sold)
+        return self._matchers[key]
+
+    def matches(self, same_zip=True, same_county=False, same_city=False, same_sub=False,
+                same_beds=True, sf_range=15, rows=None):
+        # rows: listing positions to return, in that order (default: every listing).
+        key = (bool(same_zip), bool(same_county), bool(same_city), bool(same_sub), bool(same_beds), sf_range)
+        n = len(self.df_active)
+        rows = np.arange(n) if rows is None else np.asarray(rows, dtype=np.int64)
+        with self._lock:
+            if key in self._windows:
+                self._windows.move_to_end(key)
+            else:
+                buckets = self.matcher(key[0], key[1]).buckets(selected_keys(*key[:5]))
+                self._windows[key] = (buckets, np.zeros(n, dtype=np.int64), np.zeros(n, dtype=np.int64),
+                                      np.zeros(n, dtype=bool))
+                while len(self._windows) > MATCHES_PER_INDEX:
+                    self._windows.popitem(last=False)
+            buckets, lo, hi, done = self._windows[key]
+            todo = np.unique(rows[~done[rows]])
+            if len(todo):
+                lo[todo], hi[todo] = buckets.windows(self.df_active.iloc[todo], sf_range)
+                done[todo] = True
+            return CompMatches(buckets, self.df_active.iloc[rows], lo[rows], hi[rows])
+
@@ -0,0 +1,158 @@
+import os
+import tempfile
+import urllib.parse
+from datetime import datetime
+from numbers import Number
+
+import numpy as np
+import pandas as pd
+import xlsxwriter
+
+ACTIVE_COLS = ['MLS #', 'Status', 'Area', 'Address', 'County', 'City', 'Zip', 'Sub',
+               'Bedrooms', 'Full Baths', 'Total Finished SF', 'List Price', 'List Dt']
+COMPS_COLS = ['MLS #', 'Status', 'Area', 'Address', 'County', 'City', 'Zip', 'Sub',
+              'Bedrooms', 'Full Baths', 'Total Finished SF', 'Sale Price', 'Close Dt']
+DETAILS_COLS = ACTIVE_COLS + ['Zillow'] + [col for col in COMPS_COLS if col not in ACTIVE_COLS]
+MONEY_COLS = ['Avg_List_Price', 'Avg_Sold_Price', 'Sold - List ($)', 'List Price', 'Avg Comp Price',
+              'Price Diff ($)', 'Sale Price']
+PERCENT_COLS = ['Sold - List (%)', 'Price Diff (%)']
+DATE_COLS = ['List Dt', 'Close Dt']
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def zillow_search_url(address):
+    if pd.isna(address):
+        return ""
+    address_url = urllib.parse.quote(str(address).replace(" ", "-"))
+    return f"https://www.zillow.com/homes/{address_url}_rb/"
+
+
+def zillow_search_urls(addresses):
+    # Column-wise zillow_search_url: quoting runs once per distinct address.
+    quoted = addresses.astype(str).str.replace(" ", "-")
+    distinct = quoted.dropna().unique()
+    quoted = quoted.map(dict(zip(distinct, map(urllib.parse.quote, distinct))))
+    urls = "https://www.zillow.com/homes/" + quoted + "_rb/"
+    return urls.where(addresses.notna(), "")
+
+
+def zillow_formulas(addresses):
+    formulas = '=HYPERLINK("' + zillow_search_urls(addresses) + '", "Zillow")'
+    return formulas.where(addresses.notna(), "")
+
+
+def criteria_frame(same_zip, same_county, same_city, same_sub, same_beds, sf_range, sort_selection, sub_filter=None,
+                   geo=None, valuation=None):
+    # geo: geo.GeoCriteria when comps were matched by distance
+    # valuation: valuation.Valuation the comp prices were computed with
+    if geo is not None:
+        same_zip = same_county = same_city = same_sub = False
+    df = pd.DataFrame({
+        "Same ZIP": [same_zip],
+        "Same County": [same_county],
+        "Same City": [same_city],
+        "Same Sub": [same_sub],
+        "Same # Bedrooms": [same_beds],
+        "SF Range (%)": [sf_range],
+        "Sort selection": [sort_selection],
+        "Sub filter": [', '.join(map(str, sub_filter)) if sub_filter else None],
+    })
+    if geo is not None:
+        df.insert(6, "Within (miles)", geo.within_miles)
+        df.insert(7, "Nearest comps", geo.nearest or None)
+    if valuation is not None:
+        df["Comp estimate"] = valuation.estimate
+        df["Max comp age (days)"] = valuation.max_age_days
+        df["Recency half-life (days)"] = valuation.half_life_days
+    return df
+
+
+def export_filename():
+    nowstr = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    return f"flip_analysis_{nowstr}.xlsx"
+
+
+# ===================== STREAMING WRITER =====================
+class _SheetWriter:
+    # Writes one worksheet strictly top to bottom, as constant_memory mode requires.
+
+    def __init__(self, workbook, name, columns, formats):
+        self.sheet = workbook.add_worksheet(name)
+        self.columns = list(columns)
+        self.col_formats = [formats.get(col) for col in self.columns]
+        self.row = 0
+        header = formats['header']
+        for c, col in enumerate(self.columns):
+            self.sheet.write_string(0, c, str(col), header)
+        self.row = 1
+
+    def write_cell(self, c, value):
+        if value is None or (not isinstance(value, str) and pd.isna(value)):
+            return
+        fmt = self.col_formats[c]
+        if isinstance(value, (bool, np.bool_)):
+            self.sheet.write_boolean(self.row, c, bool(value))
+        elif isinstance(value, Number):
+            self.sheet.write_number(self.row, c, float(value), fmt)
+        elif isinstance(value, (datetime, pd.Timestamp)):
+            self.sheet.write_datetime(self.row, c, value.to_pydatetime() if isinstance(value, pd.Timestamp) else value, fmt)
+        elif isinstance(value, str) and value.startswith('='):
+            self.sheet.write_formula(self.row, c, value)
+        else:
+            self.sheet.write_string(self.row, c, str(value))
+
+    def write_values(self, values):
+        for c, value in enumerate(values):
+            self.write_cell(c, value)
+        self.row += 1
+
+    def write_record(self, record):
+        self.write_values([record.get(col) for col in self.columns])
+
+    def write_frame(self, df):
+        positions = [df.columns.get_loc(col) if col in df.columns else None for col in self.columns]
+        for values in df.itertuples(index=False, name=None):
+            self.write_values([values[p] if p is not None else None for p in positions])
+
+
+def write_workbook(output, summary_df, focused_df, details, criteria_df):
+    # details yields (active_row, comps) pairs; comps are pulled one listing at a time
+    # so only the rows currently being written are held in memory.
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True, 'nan_inf_to_errors': True})
+    money = workbook.add_format({'num_format': '#,##0'})
+    percent = workbook.add_format({'num_format': '0.0"%"'})
+    date = workbook.add_format({'num_format': 'mm/dd/yyyy'})
+    formats = {'header': workbook.add_format({'bold': True, 'border': 1})}
+    formats.update({col: money for col in MONEY_COLS})
+    formats.update({col: percent for col in PERCENT_COLS})
+    formats.update({col: date for col in DATE_COLS})
+
+    _SheetWriter(workbook, 'Summary', summary_df.columns, formats).write_frame(summary_df)
+    _SheetWriter(workbook, 'Focused Area', focused_df.columns, formats).write_frame(focused_df)
+
+    details_sheet = _SheetWriter(workbook, 'Flip Details', DETAILS_COLS, formats)
+    for active_row, comps in details:
+        record = {col: active_row[col] for col in ACTIVE_COLS}
+        record['Zillow'] = f'=HYPERLINK("{zillow_search_url(active_row["Address"])}", "Zillow")'
+        details_sheet.write_record(record)
+        if not comps.empty:
+            comps_export = comps[COMPS_COLS].copy()
+            comps_export['Zillow'] = zillow_formulas(comps_export['Address'])
+            details_sheet.write_frame(comps_export)
+        details_sheet.write_values(["----"] * (len(ACTIVE_COLS) + 1))
+
+    _SheetWriter(workbook, 'Comps Criteria', criteria_df.columns, formats).write_frame(criteria_df)
+    workbook.close()
+
+
+def workbook_file(summary_df, focused_df, details, criteria_df):
+    # Build the workbook in a temporary file and return it opened for reading, so the
+    # download is served from disk rather than from a second in-memory copy.
+    fd, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(fd)
+    try:
+        write_workbook(path, summary_df, focused_df, details, criteria_df)
+        handle = open(path, 'rb')
+    finally:
+        os.remove(path)
+    return handle
@@ -0,0 +1,227 @@
+import functools
+import math
+import os
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from comps import close_dates, expand_ranges, mean_price, price_stats
+
+EARTH_RADIUS_MILES = 3958.8
+MILES_PER_DEGREE = EARTH_RADIUS_MILES * math.pi / 180
+GRID_CELL_MILES = 1.0
+LAT_COLUMNS = ['Latitude', 'Lat']
+LON_COLUMNS = ['Longitude', 'Lon', 'Lng', 'Long']
+ZIP_CENTROIDS_FILE = os.environ.get('FLIPS_ZIP_CENTROIDS', 'zip_centroids.csv')
+
+# Distance-based comp criteria: every sold comp within within_miles (only the nearest
+# `nearest` of them when nearest > 0) with the same beds / SF window rules.
+GeoCriteria = namedtuple('GeoCriteria', ['within_miles', 'nearest', 'same_beds', 'sf_range'])
+
+
+# ===================== COORDINATES =====================
+@functools.lru_cache(maxsize=4)
+def _read_zip_centroids(path, mtime):
+    df = pd.read_csv(path, dtype={'Zip': str})
+    df['Zip'] = zip5(df['Zip'])
+    return df.drop_duplicates('Zip').set_index('Zip')[['Latitude', 'Longitude']].astype(float)
+
+
+def load_zip_centroids(path=ZIP_CENTROIDS_FILE):
+    # Optional local CSV with Zip, Latitude, Longitude columns; None if there isn't one.
+    if not path or not os.path.exists(path):
+        return None
+    return _read_zip_centroids(path, os.path.getmtime(path))
+
+
+def zip5(series):
+    return series.astype(str).str.strip().str[:5].str.zfill(5)
+
+
+def _coordinate_column(df, names):
+    for name in names:
+        if name in df.columns:
+            return pd.to_numeric(df[name], errors='coerce').to_numpy(dtype=float)
+    return np.full(len(df), np.nan)
+
+
+def coordinates(df, centroids=None):
+    # (lat, lon) arrays from the data's own columns, falling back to the ZIP centroid.
+    lat = _coordinate_column(df, LAT_COLUMNS)
+    lon = _coordinate_column(df, LON_COLUMNS)
+    missing = np.isnan(lat) | np.isnan(lon)
+    if centroids is not None and 'Zip' in df.columns and missing.any():
+        found = centroids.reindex(zip5(df['Zip'][missing]))
+        lat[missing] = found['Latitude'].to_numpy()
+        lon[missing] = found['Longitude'].to_numpy()
+    return lat, lon
+
+
+def has_coordinates(df, centroids=None):
+    return bool((~np.isnan(coordinates(df, centroids)[0])).any())
+
+
+def haversine_miles(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+# ===================== SPATIAL INDEX =====================
+class GeoIndex:
+    # Grid buckets over (lat, lon). Points are sorted by cell id with the latitude cell
+    # as the minor key, so each column of cells around a query point is one
+    # searchsorted range; distances are only computed for points in those cells.
+
+    def __init__(self, lat, lon, cell_miles=GRID_CELL_MILES):
+        self.lat = lat
+        self.lon = lon
+        ok = ~np.isnan(lat) & ~np.isnan(lon)
+        self.max_abs_lat = float(np.abs(lat[ok]).max()) if ok.any() else 0.0
+        ref_lat = float(np.mean(lat[ok])) if ok.any() else 0.0
+        self.cell_lat = cell_miles / MILES_PER_DEGREE
+        self.cell_lon = cell_miles / (MILES_PER_DEGREE * max(math.cos(math.radians(ref_lat)), 0.01))
+        self.n_lat_cells = int(180 / self.cell_lat) + 2
+        order = np.flatnonzero(ok)
+        cx, cy = self._cells(lat[order], lon[order])
+        cell_ids = cx * self.n_lat_cells + cy
+        sort_idx = np.argsort(cell_ids, kind='stable')
+        self.order = order[sort_idx]
+        self.cell_ids = cell_ids[sort_idx]
+
+    def _cells(self, lat, lon):
+        return (np.floor(lon / self.cell_lon).astype(np.int64),
+                np.floor((lat + 90) / self.cell_lat).astype(np.int64))
+
+    def within(self, lat, lon, miles, accept=None):
+        # (query, point, distance) for every indexed point within `miles` of each query
+        # point that also passes accept(query, point). query indexes lat/lon.
+        queries = np.flatnonzero(~np.isnan(lat) & ~np.isnan(lon))
+        empty = np.zeros(0, dtype=np.int64)
+        if not len(queries) or not len(self.order):
+            return empty, empty, np.zeros(0)
+
+        # Widest latitude/longitude offsets a point within `miles` can have.
+        max_lat = min(89.9, max(self.max_abs_lat, float(np.abs(lat[queries]).max())) + miles / MILES_PER_DEGREE)
+        d_lat = miles / MILES_PER_DEGREE
+        d_lon = math.degrees(2 * math.asin(min(1.0, math.sin(miles / (2 * EARTH_RADIUS_MILES)) / math.cos(math.radians(max_lat)))))
+        r_lat = math.ceil(d_lat / self.cell_lat)
+        r_lon = math.ceil(d_lon / self.cell_lon)
+
+        cx, cy = self._cells(lat[queries], lon[queries])
+        y_lo = np.clip(cy - r_lat, 0, self.n_lat_cells - 1)
+        y_hi = np.clip(cy + r_lat, 0, self.n_lat_cells - 1)
+        found_q, found_p, found_d = [], [], []
+        for dx in range(-r_lon, r_lon + 1):
+            base = (cx + dx) * self.n_lat_cells
+            lo = np.searchsorted(self.cell_ids, base + y_lo, side='left')
+            hi = np.searchsorted(self.cell_ids, base + y_hi, side='right')
+            q, p = expand_ranges(lo, hi)
+            q, p = queries[q], self.order[p]
+            if accept is not None:
+                keep = accept(q, p)
+                q, p = q[keep], p[keep]
+            d = haversine_miles(lat[q], lon[q], self.lat[p], self.lon[p])
+            keep = d <= miles
+            found_q.append(q[keep])
+            found_p.append(p[keep])
+            found_d.append(d[keep])
+        return np.concatenate(found_q), np.concatenate(found_p), np.concatenate(found_d)
+
+
+# ===================== MATCHING =====================
+class GeoMatcher:
+    # Distance-based comp matching; the grid is built once per sold frame and shared
+    # by every radius / nearest / beds / SF combination.
+
+    def __init__(self, df_sold, centroids=None):
+        self.df_sold = df_sold
+        self.centroids = centroids
+        self.sf = pd.to_numeric(df_sold['Total Finished SF'], errors='coerce').to_numpy(dtype=float)
+        self.price = pd.to_numeric(df_sold['Sale Price'], errors='coerce').to_numpy(dtype=float)
+        self.beds = pd.to_numeric(df_sold['Bedrooms'], errors='coerce').to_numpy(dtype=float)
+        self.close_dt = close_dates(df_sold)
+        self.index = GeoIndex(*coordinates(df_sold, centroids))
+
+    def match(self, df_active, within_miles=1.0, nearest=0, same_beds=True, sf_range=15):
+        n = len(df_active)
+        lat, lon = coordinates(df_active, self.centroids)
+        listing_sf = pd.to_numeric(df_active['Total Finished SF'], errors='coerce').to_numpy(dtype=float)
+        listing_beds = pd.to_numeric(df_active['Bedrooms'], errors='coerce').to_numpy(dtype=float)
+        sf_min = listing_sf * (1 - sf_range / 100)
+        sf_max = listing_sf * (1 + sf_range / 100)
+
+        def accept(q, p):
+            keep = (self.sf[p] >= sf_min[q]) & (self.sf[p] <= sf_max[q])
+            if same_beds:
+                keep &= self.beds[p] == listing_beds[q]
+            return keep
+
+        if not nearest:
+            q, p, d = self.index.within(lat, lon, within_miles, accept)
+            return GeoMatches(self, df_active, q, p, d)
+
+        # K nearest: search a small radius first and double it only for the listings
+        # that have not found `nearest` comps yet, up to within_miles.
+        radius = min(GRID_CELL_MILES, within_miles)
+        pending = np.arange(n)
+        found = []
+        while len(pending):
+            q, p, d = self.index.within(lat[pending], lon[pending], radius, lambda q, p: accept(pending[q], p))
+            q = pending[q]
+            done = (np.bincount(q, minlength=n)[pending] >= nearest) | (radius >= within_miles)
+            keep = np.isin(q, pending[done])
+            found.append((q[keep], p[keep], d[keep]))
+            pending = pending[~done]
+            radius = min(radius * 2, within_miles)
+        q, p, d = (np.concatenate(parts) for parts in zip(*found))
+        sort_idx = np.lexsort((d, q))
+        q, p, d = q[sort_idx], p[sort_idx], d[sort_idx]
+        starts = np.searchsorted(q, q, side='left')
+        keep = np.arange(len(q)) - starts < nearest
+        return GeoMatches(self, df_active, q[keep], p[keep], d[keep])
+
+
+class GeoMatches:
+    # Same interface as comps.CompMatches, stored as one (comp, distance) list per listing.
+
+    def __init__(self, matcher, df_active, listing, comp, distance):
+        self.matcher = matcher
+        self.df_active = df_active
+        n = len(df_active)
+        sort_idx = np.lexsort((comp, listing))  # comps in their original row order
+        listing = listing[sort_idx]
+        self.comp = comp[sort_idx]
+        self.distance = distance[sort_idx]
+        self.num_comps = np.bincount(listing, minlength=n)
+        self.indptr = np.concatenate([[0], np.cumsum(self.num_comps)])
+
+        prices = matcher.price[self.comp]
+        has_price = ~np.isnan(prices)
+        priced = np.bincount(listing, weights=has_price, minlength=n)
+        price_sum = np.bincount(listing, weights=np.where(has_price, prices, 0.0), minlength=n)
+        self.avg_comp_price, self.price_diff, self.price_diff_pct = price_stats(df_active, self.num_comps, mean_price(priced, price_sum))
+
+    def __len__(self):
+        return len(self.num_comps)
+
+    def positions(self, i):
+        return self.comp[self.indptr[i]:self.indptr[i + 1]]
+
+    def pairs(self):
+        # (listing, sold row position) for every matched comp
+        return np.repeat(np.arange(len(self.num_comps)), self.num_comps), self.comp
+
+    @classmethod
+    def concat(cls, parts, df_active):
+        # One GeoMatches for df_active from matches of its consecutive row chunks.
+        offsets = np.cumsum([0] + [len(part) for part in parts[:-1]])
+        listing = [part.pairs()[0] + offset for part, offset in zip(parts, offsets)]
+        return cls(parts[0].matcher, df_active, np.concatenate(listing),
+                   np.concatenate([part.comp for part in parts]), np.concatenate([part.distance for part in parts]))
+
+    def comps(self, i, start=None, stop=None):
+        rows = slice(self.indptr[i], self.indptr[i + 1])
+        return self.matcher.df_sold.iloc[self.comp[rows][start:stop]].assign(
+            **{'Distance (mi)': self.distance[rows][start:stop].round(2)})
@@ -0,0 +1,142 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+from export import ACTIVE_COLS, COMPS_COLS
+from geo import LAT_COLUMNS, LON_COLUMNS
+from shared import SharedCache
+
+CATEGORY_COLUMNS = ['Zip', 'County', 'City', 'Sub', 'Status', 'Area']
+NUMERIC_COLUMNS = ['List Price', 'Sale Price', 'Total Finished SF']
+DATE_COLUMNS = ['List Dt', 'Close Dt']
+CACHE_SIZE = 8
+# Files at least this large are ingested in chunks (see stream_mls_csv).
+STREAM_MIN_BYTES = int(os.environ.get('FLIPS_STREAM_INGEST_MB', '64')) * 2**20
+STREAM_CHUNK_ROWS = 100_000
+STREAM_COLUMNS = list(dict.fromkeys(ACTIVE_COLS + COMPS_COLS + LAT_COLUMNS + LON_COLUMNS))
+
+_lock = threading.Lock()
+datasets = SharedCache(spare=CACHE_SIZE)  # (content hash, status) -> (frame, status column, status subset)
+_digests = OrderedDict()  # Streamlit upload file_id -> content hash
+
+
+def content_hash(uploaded):
+    file_id = getattr(uploaded, 'file_id', None)
+    if file_id is not None and file_id in _digests:
+        return _digests[file_id]
+    digest = hashlib.sha256(uploaded.getvalue()).hexdigest()
+    if file_id is not None:
+        with _lock:
+            _digests[file_id] = digest
+            while len(_digests) > CACHE_SIZE * 4:
+                _digests.popitem(last=False)
+    return digest
+
+
+def find_status_column(df):
+    status_cols = [col for col in df.columns if 'status' in col.lower()]
+    return status_cols[0] if status_cols else None
+
+
+def normalize_status(series):
+    return series.astype(str).str.strip().str.lower().astype('category')
+
+
+def read_mls_csv(data):
+    header = pd.read_csv(BytesIO(data), nrows=0).columns
+    dtype = {col: 'category' for col in CATEGORY_COLUMNS if col in header}
+    df = pd.read_csv(BytesIO(data), dtype=dtype)
+    for col in NUMERIC_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+    return parse_dates(df)
+
+
+def parse_dates(df):
+    # Exports repeat the same few thousand dates, so each distinct string is parsed once.
+    for col in DATE_COLUMNS:
+        if col in df.columns and not pd.api.types.is_datetime64_any_dtype(df[col]):
+            codes, uniques = pd.factorize(df[col])
+            parsed = pd.to_datetime(pd.Series(uniques, dtype=object), errors='coerce').to_numpy()
+            df[col] = np.append(parsed, np.datetime64('NaT'))[codes]  # code -1 (missing) -> NaT
+    return df
+
+
+def downcast(df):
+    # Numeric columns with only whole values and no gaps become the smallest int type
+    # that holds them; prices and SF with gaps stay float64 so averages are unchanged.
+    for col in df.columns:
+        values = df[col]
+        if values.dtype.kind in 'iuf' and len(values) and values.notna().all() and (values % 1 == 0).all():
+            df[col] = pd.to_numeric(values, downcast='integer')
+    return df
+
+
+def stream_mls_csv(source, status, chunk_rows=STREAM_CHUNK_ROWS):
+    # Out-of-core ingest for large exports (source is raw bytes or a path): reads
+    # chunk_rows rows at a time, keeps only the columns the analysis uses and the rows
+    # whose normalized status == status, so peak memory follows the retained rows, not
+    # the file. Returns split_status's (frame, status column, subset), where the frame
+    # holds only the retained rows.
+    def open_source():
+        return BytesIO(source) if isinstance(source, bytes) else source
+
+    header = pd.read_csv(open_source(), nrows=0).columns
+    status_col = find_status_column(pd.DataFrame(columns=header))
+    keep = [col for col in header if col in STREAM_COLUMNS or col == status_col]
+    dtype = {col: str for col in CATEGORY_COLUMNS if col in keep}
+    parts = []
+    for chunk in pd.read_csv(open_source(), usecols=keep, dtype=dtype, chunksize=chunk_rows):
+        if status_col is not None:
+            chunk[status_col] = chunk[status_col].astype(str).str.strip().str.lower()
+            chunk = chunk[chunk[status_col] == status]
+        for col in NUMERIC_COLUMNS:
+            if col in chunk.columns:
+                chunk[col] = pd.to_numeric(chunk[col], errors='coerce')
+        parts.append(downcast(chunk))
+    df = pd.concat(parts) if parts else pd.DataFrame(columns=keep)  # keeps the file's row numbers
+    del parts
+    for col in df.columns:
+        if col in CATEGORY_COLUMNS or col == status_col:
+            df[col] = df[col].astype('category')
+    df = parse_dates(df)
+    return df, status_col, (df if status_col is not None else None)
+
+
+def read_mls_status(data, status):
+    if len(data) >= STREAM_MIN_BYTES:
+        return stream_mls_csv(data, status)
+    return split_status(read_mls_csv(data), status)
+
+
+def split_status(df, status):
+    status_col = find_status_column(df)
+    subset = None
+    if status_col is not None:
+        df[status_col] = normalize_status(df[status_col])
+        subset = df[df[status_col] == status]
+    return df, status_col, subset
+
+
+def load_mls_file(path, status):
+    if os.path.getsize(path) >= STREAM_MIN_BYTES:
+        return stream_mls_csv(path, status)
+    with open(path, 'rb') as f:
+        return split_status(read_mls_csv(f.read()), status)
+
+
+def load_mls_csv(uploaded, status, lease=None):
+    # Returns (full frame, status column, rows whose normalized status == status); for
+    # files over STREAM_MIN_BYTES the frame is just those rows (see stream_mls_csv).
+    # Frames are shared between reruns and sessions and must be treated as read-only;
+    # a session's lease keeps its dataset cached while the session is alive.
+    key = (content_hash(uploaded), status)
+    entry = datasets.get(key, lambda: read_mls_status(uploaded.getvalue(), status))
+    if lease is not None:
+        lease.hold(status, datasets, key)
+    return entry
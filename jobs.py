@@ -0,0 +1,137 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import pandas as pd
+
+from analysis import comp_results, rank_candidates
+from perf import StageTimer
+from shared import SharedCache
+
+JOB_WORKERS = int(os.environ.get('FLIPS_JOB_WORKERS', '2'))
+JOB_CHUNK_ROWS = 2000
+JOBS_KEPT = 16
+
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='flips-job')
+jobs = SharedCache(spare=JOBS_KEPT)  # (data key, criteria, focus, sf_label, valuation) -> CandidatesJob
+
+
+class CandidatesJob:
+    # Ranks listings(focus) for one criteria/valuation on the background pool, a chunk
+    # of listings at a time, so the UI can poll progress and show the partially ranked
+    # table. Comp windows computed before a cancel stay cached in the pipeline, so a
+    # resumed job only matches the remaining listings. The pipeline is released once
+    # the job finishes; the ranked table is also cached in the pipeline.
+
+    def __init__(self, key, pipeline, criteria, focus=None, sf_label='Total Finished SF', valuation=None):
+        self.key = key
+        self.pipeline = pipeline
+        self.criteria = criteria
+        self.focus = focus
+        self.sf_label = sf_label
+        self.valuation = valuation
+        self.total = len(pipeline.listings(focus))
+        self.done_rows = 0
+        self.partial = None  # ranked table of the listings matched so far
+        self.result = None
+        self.error = None
+        self.seconds = None
+        self.perf = StageTimer(job=f"{id(self):x}")  # matching / valuation / ranking, summed over chunks
+        self._cancelled = threading.Event()
+        self._future = _executor.submit(self._run)
+
+    def _run(self):
+        start = time.perf_counter()
+        pipeline = self.pipeline
+        spent = {'comp_matching': 0.0, 'comp_valuation': 0.0, 'candidate_ranking': 0.0}
+        try:
+            if self._cancelled.is_set():  # cancelled while still queued
+                return
+            listings = pipeline.listings(self.focus)
+            as_of = pipeline.as_of()
+            results = []
+            matches = pipeline.iter_matches(self.criteria, self.focus, JOB_CHUNK_ROWS)
+            while True:
+                t = time.perf_counter()
+                done_rows, part = next(matches, (None, None))
+                spent['comp_matching'] += time.perf_counter() - t
+                if part is None:
+                    break
+                if self._cancelled.is_set():
+                    return
+                t = time.perf_counter()
+                results.append(comp_results(part, self.valuation, as_of))
+                spent['comp_valuation'] += time.perf_counter() - t
+                t = time.perf_counter()
+                self.partial = rank_candidates(listings.iloc[:done_rows], pd.concat(results, ignore_index=True),
+                                               self.sf_label)
+                spent['candidate_ranking'] += time.perf_counter() - t
+                self.done_rows = done_rows
+            if self.partial is None:  # no listings
+                self.partial = pipeline.candidates(self.criteria, self.focus, self.sf_label, self.valuation)
+            self.result = pipeline.store_candidates(self.criteria, self.focus, self.sf_label, self.valuation, self.partial)
+            self.done_rows = self.total
+            for name, seconds in spent.items():
+                self.perf.record(name, seconds, rows=self.total)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.seconds = time.perf_counter() - start
+            self.pipeline = None
+
+    @property
+    def progress(self):
+        return self.done_rows / self.total if self.total else 1.0
+
+    @property
+    def finished(self):
+        return self._future.done()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def wait(self, timeout=None):
+        wait([self._future], timeout=timeout)
+        return self.finished
+
+
+def _usable(job):
+    return not job.cancelled and job.error is None
+
+
+def _cancel_unwatched(key):
+    job = jobs.peek(key)
+    if job is not None and not job.finished and not jobs.held(key):
+        job.cancel()
+
+
+def watch_job(lease, slot, pipeline, criteria, focus=None, sf_label='Total Finished SF', valuation=None):
+    # The running or finished job for these inputs, shared by every session analysing
+    # the same data and held in the session's lease slot. The job it replaces in that
+    # slot is cancelled only if no other session is holding it.
+    key = (pipeline.key, criteria, focus, sf_label, valuation)
+    job = jobs.get(key, lambda: CandidatesJob(key, pipeline, criteria, focus, sf_label, valuation), valid=_usable)
+    previous = lease.key(slot)
+    lease.hold(slot, jobs, key)
+    if previous is not None and previous != key:
+        _cancel_unwatched(previous)
+    return job
+
+
+def unwatch_job(lease, slot):
+    # This session stops watching its job; the job is cancelled if nobody else is.
+    key = lease.key(slot)
+    lease.drop(slot)
+    if key is not None:
+        _cancel_unwatched(key)
+
+
+def drop_jobs(data_key):
+    # The pipeline for data_key was evicted; its jobs go with it.
+    for job in jobs.discard(lambda key: key[0] == data_key):
+        job.cancel()
@@ -0,0 +1,63 @@
+import json
+import logging
+import os
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+
+import pandas as pd
+
+logger = logging.getLogger('flips.perf')
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter('%(asctime)s %(name)s %(message)s'))
+    logger.addHandler(_handler)
+    logger.setLevel(os.environ.get('FLIPS_PERF_LOG', 'INFO').upper())
+    logger.propagate = False
+
+
+class StageTimer:
+    # Wall time, row count and (optionally) peak traced memory for each stage of one run.
+    # Every finished stage is also logged as a single JSON line on the flips.perf logger.
+    # tracemalloc is process-wide, so with several sessions busy at once peaks include
+    # their allocations too.
+
+    def __init__(self, trace_memory=False, **context):
+        self.trace_memory = trace_memory
+        self.context = {'run': uuid.uuid4().hex[:8], **context}
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        record = {'stage': name, 'rows': rows}
+        tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        elif self.trace_memory:
+            tracemalloc.reset_peak()
+        start_mem = tracemalloc.get_traced_memory()[0] if self.trace_memory else 0
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = round(time.perf_counter() - start, 6)
+            if self.trace_memory:
+                record['peak_mb'] = round((tracemalloc.get_traced_memory()[1] - start_mem) / 2**20, 3)
+            if tracing:
+                tracemalloc.stop()
+            self.stages.append(record)
+            logger.info(json.dumps({**self.context, **record}, default=str))
+
+    def record(self, name, seconds, rows=None):
+        # A stage timed elsewhere, e.g. summed over the chunks of a background job.
+        record = {'stage': name, 'rows': rows, 'seconds': round(seconds, 6)}
+        self.stages.append(record)
+        logger.info(json.dumps({**self.context, **record}, default=str))
+
+    def frame(self):
+        columns = ['stage', 'seconds', 'rows'] + (['peak_mb'] if self.trace_memory else [])
+        df = pd.DataFrame(self.stages, columns=columns)
+        total = df['seconds'].sum()
+        df['share (%)'] = (df['seconds'] / total * 100).round(1) if total else 0.0
+        return df
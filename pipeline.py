@@ -0,0 +1,164 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from analysis import comp_results, rank_candidates, summarize
+from comps import CompIndex, close_dates, latest_close
+from geo import GeoCriteria, GeoMatcher, GeoMatches, has_coordinates, load_zip_centroids
+from jobs import drop_jobs
+from shared import SharedCache
+
+PIPELINE_CACHE_SIZE = 4
+STAGE_CACHE_SIZE = 64
+
+# data key -> AnalysisPipeline; an evicted pipeline's background jobs are dropped with it
+pipelines = SharedCache(spare=PIPELINE_CACHE_SIZE, on_evict=lambda key, pipeline: drop_jobs(key))
+
+
+def focus_key(sort_selection=None, sub_filter=None):
+    # Hashable focus area; None means every active listing.
+    if not sub_filter:
+        return None
+    return (sort_selection, tuple(sorted(set(map(str, sub_filter)))))
+
+
+def criteria_key(same_zip, same_county, same_city, same_sub, same_beds, sf_range):
+    return (bool(same_zip), bool(same_county), bool(same_city), bool(same_sub), bool(same_beds), sf_range)
+
+
+class AnalysisPipeline:
+    # The stages after ingest, each cached on the inputs it actually reads:
+    #   summary (sort) -> focus rows (focus) -> comp windows (criteria, rows)
+    #   -> ranked table (criteria, focus, valuation) -> detail views (slices of the windows)
+    # so a rerun only recomputes what changed. Comp windows are kept per listing by
+    # CompIndex: widening a focus area matches just the newly added listings, and
+    # picking an MLS # for details does no matching at all.
+
+    def __init__(self, df_active, df_sold, comps_store=None, key=None):
+        self.key = key  # data key it is shared under (see get_pipeline)
+        self.df_active = df_active
+        self.df_sold = df_sold
+        self.comps = CompIndex(df_active, df_sold, comps_store)
+        self.comps_store = comps_store
+        self._geo = None
+        self._results = OrderedDict()
+        self._lock = threading.RLock()
+
+    def _stage(self, key, compute):
+        with self._lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                return self._results[key]
+            result = compute()
+            self._results[key] = result
+            while len(self._results) > STAGE_CACHE_SIZE:
+                self._results.popitem(last=False)
+            return result
+
+    # ---- summary ----
+    def summary(self, sort_selection):
+        def compute():
+            if self.df_sold is None:  # comps store: sold totals are aggregated on disk
+                return summarize(self.df_active, None, sort_selection, self.comps_store.sold_totals(sort_selection))
+            return summarize(self.df_active, self.df_sold, sort_selection)
+        return self._stage(('summary', sort_selection), compute)
+
+    # ---- focus area ----
+    def focus_rows(self, focus=None):
+        if focus is None:
+            return None
+        column, values = focus
+        return self._stage(('focus_rows', focus),
+                           lambda: np.flatnonzero(self.df_active[column].astype(str).isin(values).to_numpy()))
+
+    def listings(self, focus=None):
+        if focus is None:
+            return self.df_active
+        return self._stage(('listings', focus), lambda: self.df_active.iloc[self.focus_rows(focus)])
+
+    def mls_positions(self, focus=None):
+        # MLS # -> position within listings(focus)
+        return self._stage(('mls_positions', focus),
+                           lambda: {mls: i for i, mls in enumerate(self.listings(focus)['MLS #'].astype(str))})
+
+    # ---- comps ----
+    def matches(self, criteria, focus=None):
+        return self._stage(('matches', criteria, focus), lambda: self._match(criteria, focus))
+
+    def iter_matches(self, criteria, focus=None, chunk_rows=2000):
+        # Matches listings(focus) chunk by chunk, yielding (listings done, chunk matches);
+        # once every chunk is done the whole result is cached as matches() would cache it.
+        key = ('matches', criteria, focus)
+        with self._lock:
+            cached = self._results.get(key)
+        if cached is not None:
+            yield len(cached), cached
+            return
+        listings = self.listings(focus)
+        rows = self.focus_rows(focus)
+        rows = np.arange(len(self.df_active)) if rows is None else rows
+        parts = []
+        for start in range(0, len(listings), chunk_rows):
+            chunk = slice(start, start + chunk_rows)
+            if isinstance(criteria, GeoCriteria):
+                part = self.geo_matcher().match(listings.iloc[chunk], *criteria)
+            else:
+                with self._lock:  # CompIndex fills its windows in place
+                    part = self.comps.matches(*criteria, rows=rows[chunk])
+            parts.append(part)
+            yield min(start + chunk_rows, len(listings)), part
+        if isinstance(criteria, GeoCriteria) and parts:
+            result = GeoMatches.concat(parts, listings)
+        else:
+            result = self._match(criteria, focus)  # windows are cached by now
+        self._stage(key, lambda: result)
+
+    def _match(self, criteria, focus):
+        if isinstance(criteria, GeoCriteria):
+            return self.geo_matcher().match(self.listings(focus), *criteria)
+        return self.comps.matches(*criteria, rows=self.focus_rows(focus))
+
+    def geo_available(self):
+        # Listings (and, without a store, comps) have coordinates or a ZIP centroid.
+        def compute():
+            centroids = load_zip_centroids()
+            if self.comps_store is None and not has_coordinates(self.df_sold, centroids):
+                return False
+            return has_coordinates(self.df_active, centroids)
+        return self._stage(('geo_available',), compute)
+
+    def geo_matcher(self):
+        # The spatial index is built once per comps data, on first use.
+        with self._lock:
+            if self._geo is None:
+                self._geo = GeoMatcher(self.comps.matcher(False, False).df_sold, load_zip_centroids())
+            return self._geo
+
+    def as_of(self):
+        # Comp ages are measured from one date for the whole comps data; in store mode
+        # each (Same ZIP, Same County) matcher only loads some partitions.
+        def compute():
+            if self.df_sold is None:
+                return self.comps_store.latest_close()
+            return latest_close(close_dates(self.df_sold))
+        return self._stage(('as_of',), compute)
+
+    def candidates(self, criteria, focus=None, sf_label='Total Finished SF', valuation=None):
+        return self._stage(('candidates', criteria, focus, sf_label, valuation),
+                           lambda: rank_candidates(self.listings(focus), comp_results(self.matches(criteria, focus), valuation, self.as_of()),
+                                                   sf_label))
+
+    def store_candidates(self, criteria, focus, sf_label, valuation, ranked):
+        # Caches a ranked table built chunk by chunk elsewhere (jobs.CandidatesJob), so
+        # candidates() returns it without recomputing; an existing entry wins.
+        return self._stage(('candidates', criteria, focus, sf_label, valuation), lambda: ranked)
+
+
+def get_pipeline(key, df_active, df_sold, comps_store=None, lease=None):
+    # key identifies the uploaded data (content hashes / store version), so every
+    # session analysing the same data shares one pipeline and its cached results.
+    pipeline = pipelines.get(key, lambda: AnalysisPipeline(df_active, df_sold, comps_store, key))
+    if lease is not None:
+        lease.hold('pipeline', pipelines, key)
+    return pipeline
@@ -0,0 +1,102 @@
+import threading
+import weakref
+from collections import Counter, OrderedDict
+
+
+class SharedCache:
+    # Process-wide cache of read-only objects shared by every session. Entries a live
+    # session holds (see SessionLease) are never evicted; up to `spare` unheld entries
+    # are kept as an LRU so re-uploading a recent file is still a cache hit.
+
+    def __init__(self, spare, on_evict=None):
+        self.spare = spare
+        self.on_evict = on_evict  # called with (key, value) for every evicted entry
+        self._entries = OrderedDict()
+        self._refs = Counter()
+        self._lock = threading.Lock()
+
+    def get(self, key, build, valid=None):
+        # valid(value) returning False marks a cached entry as stale, so it is rebuilt.
+        with self._lock:
+            if key in self._entries and (valid is None or valid(self._entries[key])):
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        # Built outside the lock so a slow parse doesn't block other sessions; if two
+        # sessions race, the first result stored wins.
+        value = build()
+        with self._lock:
+            current = self._entries.get(key)
+            if current is not None and (valid is None or valid(current)):
+                value = current
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            self._evict()
+            return value
+
+    def peek(self, key):
+        with self._lock:
+            return self._entries.get(key)
+
+    def held(self, key):
+        with self._lock:
+            return self._refs[key] > 0
+
+    def discard(self, match):
+        # Drops every entry whose key passes match(key), held or not; returns their values.
+        with self._lock:
+            keys = [key for key in self._entries if match(key)]
+            return [self._entries.pop(key) for key in keys]
+
+    def acquire(self, key):
+        with self._lock:
+            self._refs[key] += 1
+
+    def release(self, key):
+        with self._lock:
+            self._refs[key] -= 1
+            if self._refs[key] <= 0:
+                del self._refs[key]
+                self._evict()
+
+    def _evict(self):
+        idle = [key for key in self._entries if not self._refs[key]]
+        for key in idle[:max(0, len(idle) - self.spare)]:
+            value = self._entries.pop(key)
+            if self.on_evict is not None:
+                self.on_evict(key, value)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'held': sum(1 for key in self._entries if self._refs[key])}
+
+
+def _release_all(held):
+    for cache, key in held.values():
+        cache.release(key)
+    held.clear()
+
+
+class SessionLease:
+    # The shared entries one session is using, one per slot ('active', 'sold', ...).
+    # Holding a new key in a slot releases the old one; when the session's state is
+    # dropped the lease is garbage collected and everything it held is released.
+
+    def __init__(self):
+        self._held = {}
+        weakref.finalize(self, _release_all, self._held)
+
+    def hold(self, slot, cache, key):
+        if self._held.get(slot) == (cache, key):
+            return
+        cache.acquire(key)
+        self.drop(slot)
+        self._held[slot] = (cache, key)
+
+    def key(self, slot):
+        held = self._held.get(slot)
+        return held[1] if held else None
+
+    def drop(self, slot):
+        if slot in self._held:
+            cache, key = self._held.pop(slot)
+            cache.release(key)
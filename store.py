@@ -0,0 +1,201 @@
+import os
+import threading
+import urllib.parse
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+
+from comps import normalize_key
+from ingest import CATEGORY_COLUMNS, DATE_COLUMNS, find_status_column, parse_dates
+
+COMPS_STORE_DIR = os.environ.get('FLIPS_COMPS_STORE', 'comps_store')
+PARTITION_FILE = 'comps.feather'
+INDEX_FILE = '_mls_index.feather'
+
+
+def _quote(value):
+    return urllib.parse.quote(str(value), safe='')
+
+
+def _decoded(column):
+    return column.cast(column.type.value_type) if pa.types.is_dictionary(column.type) else column
+
+
+def partition_keys(df):
+    county = normalize_key(df['County'], 'County') if 'County' in df.columns else pd.Series('nan', index=df.index)
+    zip_code = normalize_key(df['Zip'], 'Zip') if 'Zip' in df.columns else pd.Series('nan', index=df.index)
+    return 'County=' + county.map(_quote).astype(str) + '/Zip=' + zip_code.map(_quote).astype(str)
+
+
+class CompsStore:
+    # Comps history on disk as one uncompressed Feather file per County/Zip partition,
+    # deduplicated on MLS # across partitions. Partitions are memory-mapped: summary
+    # totals are aggregated one partition at a time without loading the store, while
+    # load() copies the partitions it reads (only those comp matching can reach) into
+    # a pandas frame.
+
+    def __init__(self, root=COMPS_STORE_DIR):
+        self.root = root
+        self._lock = threading.Lock()
+
+    def _path(self, partition):
+        return os.path.join(self.root, *partition.split('/'), PARTITION_FILE)
+
+    def _write(self, path, df):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        feather.write_feather(df.reset_index(drop=True), tmp_path, compression='uncompressed')
+        os.replace(tmp_path, path)
+
+    def _read(self, path, columns=None):
+        table = feather.read_table(path, memory_map=True)
+        if columns is not None:
+            table = table.select([col for col in table.column_names if col in columns or 'status' in col.lower()])
+        # Partitions are written at different times, so decode dictionaries before concatenating.
+        for i, field in enumerate(table.schema):
+            if pa.types.is_dictionary(field.type):
+                table = table.set_column(i, field.name, table.column(i).cast(field.type.value_type))
+            # Partitions written before dates were parsed at ingest hold them as text.
+            if field.name in DATE_COLUMNS and not pa.types.is_timestamp(table.schema.field(i).type):
+                dates = pd.to_datetime(table.column(i).to_pandas(), errors='coerce')
+                table = table.set_column(i, field.name, pa.array(dates)).replace_schema_metadata(None)
+        return table
+
+    def version(self):
+        path = os.path.join(self.root, INDEX_FILE)
+        return os.stat(path).st_mtime_ns if os.path.exists(path) else 0
+
+    def mls_index(self):
+        path = os.path.join(self.root, INDEX_FILE)
+        if not os.path.exists(path):
+            return pd.DataFrame({'MLS #': pd.Series(dtype=str), 'Partition': pd.Series(dtype=str)})
+        return feather.read_feather(path)
+
+    def partitions(self, counties=None, zips=None):
+        index = self.mls_index()
+        found = sorted(index['Partition'].unique().tolist())
+        if counties is not None:
+            wanted = {'County=' + _quote(county) for county in counties}
+            found = [p for p in found if p.split('/')[0] in wanted]
+        if zips is not None:
+            wanted = {'Zip=' + _quote(zip_code) for zip_code in zips}
+            found = [p for p in found if p.split('/')[1] in wanted]
+        return found
+
+    def append(self, df):
+        # Merge a weekly export into the store; later rows win for a repeated MLS #.
+        df = df.copy()
+        df['MLS #'] = df['MLS #'].astype(str).str.strip()
+        df = df.drop_duplicates(subset='MLS #', keep='last')
+        new_partitions = partition_keys(df)
+
+        with self._lock:
+            index = self.mls_index()
+            moved = index[index['MLS #'].isin(df['MLS #'])]
+            touched = set(new_partitions.unique()) | set(moved['Partition'].unique())
+            new_mls = set(df['MLS #'])
+
+            for partition in touched:
+                path = self._path(partition)
+                parts = []
+                if os.path.exists(path):
+                    existing = parse_dates(feather.read_feather(path))
+                    parts.append(existing[~existing['MLS #'].isin(new_mls)])
+                parts.append(df[new_partitions == partition])
+                merged = pd.concat(parts, ignore_index=True)
+                if merged.empty:
+                    if os.path.exists(path):
+                        os.remove(path)
+                else:
+                    self._write(path, merged)
+
+            index = pd.concat([
+                index[~index['MLS #'].isin(new_mls)],
+                pd.DataFrame({'MLS #': df['MLS #'].to_numpy(), 'Partition': new_partitions.to_numpy()}),
+            ], ignore_index=True)
+            self._write(os.path.join(self.root, INDEX_FILE), index)
+        return len(df)
+
+    def num_rows(self):
+        return len(self.mls_index())
+
+    def status_column(self):
+        for partition in self.partitions():
+            names = feather.read_table(self._path(partition), memory_map=True).column_names
+            return find_status_column(pd.DataFrame(columns=names))
+        return None
+
+    def sold_totals(self, sort_selection="ALL"):
+        # analysis.sold_totals over the sold comps in the store. Each partition is
+        # filtered and aggregated from its memory map, so only per-group totals and
+        # one partition's decoded status/group columns are ever on the heap.
+        group_col = None if sort_selection == "ALL" else sort_selection
+        parts = []
+        for partition in self.partitions():
+            table = feather.read_table(self._path(partition), memory_map=True)
+            status_col = find_status_column(pd.DataFrame(columns=table.column_names))
+            if group_col is not None and group_col not in table.column_names:
+                continue  # no group value, like NaN keys in a groupby
+            if status_col is not None:
+                table = table.filter(pc.equal(_decoded(table.column(status_col)), 'sold'))
+            price = pc.cast(table.column('Sale Price'), pa.float64())
+            price = pc.if_else(pc.is_nan(price), pa.scalar(None, pa.float64()), price)
+            columns = {'MLS #': table.column('MLS #'), 'Sale Price': price}
+            if group_col is None:
+                parts.append({'Sold_Count': table.num_rows, 'Price_Sum': pc.sum(price).as_py() or 0.0,
+                              'Priced': pc.count(price).as_py()})
+                continue
+            columns[group_col] = _decoded(table.column(group_col))
+            totals = pa.table(columns).group_by(group_col).aggregate(
+                [('MLS #', 'count'), ('Sale Price', 'sum'), ('Sale Price', 'count')]).to_pandas()
+            parts.append(totals.rename(columns={'MLS #_count': 'Sold_Count', 'Sale Price_sum': 'Price_Sum',
+                                                'Sale Price_count': 'Priced'}))
+        if group_col is None:
+            return pd.DataFrame([{col: sum(part[col] for part in parts) for col in ['Sold_Count', 'Price_Sum', 'Priced']}])
+        if not parts:
+            return pd.DataFrame(columns=['Sold_Count', 'Price_Sum', 'Priced'], index=pd.Index([], name=group_col))
+        totals = pd.concat(parts, ignore_index=True).dropna(subset=[group_col])
+        return totals.groupby(group_col)[['Sold_Count', 'Price_Sum', 'Priced']].sum()
+
+    def latest_close(self):
+        # Latest Close Dt among the sold comps, read one memory-mapped partition at a time.
+        latest = np.datetime64('NaT')
+        for partition in self.partitions():
+            table = self._read(self._path(partition), ['Close Dt'])
+            if 'Close Dt' not in table.column_names:
+                continue
+            status_col = find_status_column(pd.DataFrame(columns=table.column_names))
+            if status_col is not None:
+                table = table.filter(pc.equal(table.column(status_col), 'sold'))
+            value = pc.max(table.column('Close Dt')).as_py()
+            if value is not None:
+                value = np.datetime64(pd.Timestamp(value), 'ns')
+                latest = value if np.isnat(latest) else max(latest, value)
+        return latest
+
+    def load(self, counties=None, zips=None, columns=None):
+        tables = [self._read(self._path(p), columns) for p in self.partitions(counties, zips)]
+        tables = [table for table in tables if table.num_rows]
+        if not tables:
+            return pd.DataFrame(columns=columns or [])
+        df = pa.concat_tables(tables, promote_options='permissive').to_pandas()
+        for col in df.columns:
+            if col in CATEGORY_COLUMNS or 'status' in col.lower():
+                df[col] = df[col].astype('category')
+        return df
+
+    def load_sold(self, counties=None, zips=None, columns=None):
+        df = self.load(counties, zips, columns)
+        status_col = find_status_column(df)
+        if status_col is None:
+            return df
+        return df[df[status_col] == 'sold']
+
+    def sold_for_listings(self, df_active, same_zip, same_county, columns=None):
+        # Only the partitions the selected equality keys can reach.
+        counties = normalize_key(df_active['County'], 'County').unique() if same_county else None
+        zips = normalize_key(df_active['Zip'], 'Zip').unique() if same_zip else None
+        return self.load_sold(counties, zips, columns)
@@ -0,0 +1,83 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from comps import CompMatcher
+
+SF_RANGES = [5, 15, 50]
+
+
+def legacy_comps(df_active, df_sold, same_zip, same_county, same_city, same_sub, same_beds, sf_range):
+    # The per-listing iterrows filter CompMatcher replaced, kept as the reference.
+    rows = []
+    for _, row in df_active.iterrows():
+        listing_sf = row['Total Finished SF']
+        sf_min = listing_sf * (1 - sf_range / 100)
+        sf_max = listing_sf * (1 + sf_range / 100)
+        comps_filtered = df_sold.copy()
+        if same_zip:
+            comps_filtered = comps_filtered[comps_filtered['Zip'].astype(str).str.strip() == str(row['Zip']).strip()]
+        if same_county:
+            comps_filtered = comps_filtered[comps_filtered['County'].astype(str).str.strip().str.lower() == str(row['County']).strip().lower()]
+        if same_city:
+            comps_filtered = comps_filtered[comps_filtered['City'].astype(str).str.strip().str.lower() == str(row['City']).strip().lower()]
+        if same_sub:
+            comps_filtered = comps_filtered[comps_filtered['Sub'].astype(str).str.strip().str.lower() == str(row['Sub']).strip().lower()]
+        if same_beds:
+            comps_filtered = comps_filtered[comps_filtered['Bedrooms'] == row['Bedrooms']]
+        comps_filtered = comps_filtered[
+            (comps_filtered['Total Finished SF'] >= sf_min) &
+            (comps_filtered['Total Finished SF'] <= sf_max)
+        ]
+        avg_comp_price = comps_filtered['Sale Price'].mean() if not comps_filtered.empty else None
+        num_comps = len(comps_filtered)
+        price_diff = (avg_comp_price - row['List Price']) if avg_comp_price else None
+        rows.append((avg_comp_price, num_comps, price_diff, list(comps_filtered.index)))
+    return rows
+
+
+def messy_mls(n_rows, price_col, seed):
+    # Few distinct keys so buckets overlap, spelled with mixed case and stray whitespace,
+    # plus gaps in Sale Price, Bedrooms and SF.
+    rng = np.random.default_rng(seed)
+    zips = np.array(['27601', ' 27601', '27601 ', '27602', '27603'])
+    counties = np.array(['Wake', 'wake ', ' WAKE', 'Durham', 'durham'])
+    cities = np.array(['Raleigh', 'raleigh', 'Cary ', 'CARY', 'Apex'])
+    subs = np.array(['Oak Park', 'oak park', ' Pine Ridge', 'PINE RIDGE', 'Elm'])
+    df = pd.DataFrame({
+        'MLS #': np.arange(n_rows) + seed * 10_000,
+        'Zip': rng.choice(zips, n_rows),
+        'County': rng.choice(counties, n_rows),
+        'City': rng.choice(cities, n_rows),
+        'Sub': rng.choice(subs, n_rows),
+        'Bedrooms': rng.choice([2.0, 3.0, 4.0, np.nan], n_rows, p=[.3, .35, .25, .1]),
+        'Total Finished SF': np.round(rng.uniform(900, 2600, n_rows) / 50) * 50,
+        price_col: np.round(rng.uniform(150_000, 600_000, n_rows), -3),
+    })
+    df.loc[rng.random(n_rows) < 0.1, 'Total Finished SF'] = np.nan
+    df.loc[rng.random(n_rows) < 0.1, price_col] = np.nan
+    return df
+
+
+@pytest.fixture(scope='module')
+def data():
+    df_active = messy_mls(40, 'List Price', seed=1)
+    df_sold = messy_mls(300, 'Sale Price', seed=2)
+    return df_active, df_sold, CompMatcher(df_sold)
+
+
+@pytest.mark.parametrize('flags', list(itertools.product([False, True], repeat=5)))
+@pytest.mark.parametrize('sf_range', SF_RANGES)
+def test_matches_legacy_filter(data, flags, sf_range):
+    df_active, df_sold, matcher = data
+    expected = legacy_comps(df_active, df_sold, *flags, sf_range)
+    got = matcher.match(df_active, *flags, sf_range)
+    for i, (avg_comp_price, num_comps, price_diff, comp_rows) in enumerate(expected):
+        assert got.num_comps[i] == num_comps
+        np.testing.assert_allclose(
+            [got.avg_comp_price[i], got.price_diff[i]],
+            [np.nan if avg_comp_price is None else avg_comp_price, np.nan if price_diff is None else price_diff],
+            equal_nan=True)
+        assert list(got.comps(i).index) == comp_rows
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from geo import GeoIndex, GeoMatcher, haversine_miles
+from test_comps import messy_mls
+
+MILES = [0.5, 2.5, 7.5]
+CENTERS = [(35.8, -78.6), (65.8, -78.6)]  # and the same area 30° further north
+
+
+def with_coordinates(df, center, seed):
+    # Points scattered ~10 miles around center, a few with no coordinates.
+    rng = np.random.default_rng(seed)
+    df['Latitude'] = center[0] + rng.uniform(-0.15, 0.15, len(df))
+    df['Longitude'] = center[1] + rng.uniform(-0.15, 0.15, len(df)) / np.cos(np.radians(center[0]))
+    df.loc[rng.random(len(df)) < 0.05, 'Latitude'] = np.nan
+    return df
+
+
+def brute_force(df_active, df_sold, within_miles, nearest, same_beds, sf_range):
+    # Every (listing, comp) distance, filtered row by row; with nearest > 0 only the
+    # nearest comps within within_miles are kept.
+    expected = []
+    for _, row in df_active.iterrows():
+        d = haversine_miles(row['Latitude'], row['Longitude'], df_sold['Latitude'].to_numpy(), df_sold['Longitude'].to_numpy())
+        keep = ((d <= within_miles) &
+                (df_sold['Total Finished SF'] >= row['Total Finished SF'] * (1 - sf_range / 100)).to_numpy() &
+                (df_sold['Total Finished SF'] <= row['Total Finished SF'] * (1 + sf_range / 100)).to_numpy())
+        if same_beds:
+            keep &= (df_sold['Bedrooms'] == row['Bedrooms']).to_numpy()
+        rows = np.flatnonzero(keep)
+        if nearest:
+            rows = np.sort(rows[np.argsort(d[rows], kind='stable')[:nearest]])
+        expected.append((rows, d[rows]))
+    return expected
+
+
+@pytest.fixture(scope='module', params=CENTERS, ids=['35N', '65N'])
+def data(request):
+    df_active = with_coordinates(messy_mls(40, 'List Price', seed=5), request.param, seed=6)
+    df_sold = with_coordinates(messy_mls(600, 'Sale Price', seed=7), request.param, seed=8)
+    return df_active, df_sold, GeoMatcher(df_sold)
+
+
+@pytest.mark.parametrize('miles', MILES)
+def test_index_within_matches_brute_force(data, miles):
+    df_active, df_sold, matcher = data
+    lat, lon = df_active['Latitude'].to_numpy(), df_active['Longitude'].to_numpy()
+    q, p, d = GeoIndex(df_sold['Latitude'].to_numpy(), df_sold['Longitude'].to_numpy()).within(lat, lon, miles)
+    got = sorted(zip(q.tolist(), p.tolist()))
+    all_d = haversine_miles(lat[:, None], lon[:, None], df_sold['Latitude'].to_numpy()[None, :],
+                            df_sold['Longitude'].to_numpy()[None, :])
+    assert got == sorted(zip(*map(np.ndarray.tolist, np.nonzero(all_d <= miles))))
+    np.testing.assert_allclose(d, all_d[q, p])
+
+
+@pytest.mark.parametrize('miles', MILES)
+@pytest.mark.parametrize('nearest', [0, 1, 5])
+@pytest.mark.parametrize('same_beds', [False, True])
+def test_match_matches_brute_force(data, miles, nearest, same_beds):
+    df_active, df_sold, matcher = data
+    expected = brute_force(df_active, df_sold, miles, nearest, same_beds, 15)
+    got = matcher.match(df_active, miles, nearest, same_beds, 15)
+    for i, (rows, distance) in enumerate(expected):
+        np.testing.assert_array_equal(got.positions(i), rows)
+        np.testing.assert_allclose(got.distance[got.indptr[i]:got.indptr[i + 1]], distance)
+        assert got.num_comps[i] == len(rows)
+        prices = df_sold['Sale Price'].to_numpy()[rows]
+        expected_avg = np.nanmean(prices) if len(rows) and not np.isnan(prices).all() else np.nan
+        np.testing.assert_allclose(got.avg_comp_price[i], expected_avg, equal_nan=True)
@@ -0,0 +1,70 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from analysis import SORT_OPTIONS, summarize
+from comps import CompMatcher
+from ingest import read_mls_csv, split_status, stream_mls_csv
+from test_comps import messy_mls
+
+
+def mls_export(n_rows, price_col, date_col, seed):
+    # An export with every status mixed in (spelled inconsistently), an Area, dates and
+    # a column the analysis never reads.
+    rng = np.random.default_rng(seed)
+    df = messy_mls(n_rows, price_col, seed)
+    df.insert(1, 'Status', rng.choice(['Active', ' active', 'SOLD', 'Sold ', 'Pending'], n_rows))
+    df['Area'] = rng.choice(['North', 'South', 'East'], n_rows)
+    df[date_col] = (pd.Timestamp('2024-06-30') - pd.to_timedelta(rng.integers(0, 720, n_rows), unit='D')).strftime('%m/%d/%Y')
+    df['Remarks'] = 'x' * 20
+    return df
+
+
+@pytest.fixture(scope='module')
+def exports():
+    df_listings = mls_export(2500, 'List Price', 'List Dt', seed=11)
+    df_listings['Bedrooms'] = np.random.default_rng(12).integers(2, 5, len(df_listings))  # no gaps: streams as int8
+    df_comps = mls_export(2500, 'Sale Price', 'Close Dt', seed=13)  # Bedrooms has gaps: stays float64
+    return df_listings.to_csv(index=False).encode(), df_comps.to_csv(index=False).encode()
+
+
+def ingest(data, status, chunk_rows, source, tmp_path):
+    if source == 'path':
+        path = tmp_path / f'{status}.csv'
+        path.write_bytes(data)
+        data = str(path)
+    return stream_mls_csv(data, status, chunk_rows)
+
+
+@pytest.mark.parametrize('chunk_rows, source', [(333, 'bytes'), (1000, 'path'), (10_000, 'bytes')])
+def test_stream_matches_eager_ingest(exports, chunk_rows, source, tmp_path):
+    listings, comps = exports
+    _, active_col, df_active = split_status(read_mls_csv(listings), 'active')
+    _, sold_col, df_sold = split_status(read_mls_csv(comps), 'sold')
+    streamed_listings, streamed_active_col, streamed_active = ingest(listings, 'active', chunk_rows, source, tmp_path)
+    _, streamed_sold_col, streamed_sold = ingest(comps, 'sold', chunk_rows, source, tmp_path)
+
+    assert (streamed_active_col, streamed_sold_col) == (active_col, sold_col)
+    assert 'Remarks' not in streamed_listings.columns
+    assert streamed_active['Bedrooms'].dtype == np.int8
+    assert streamed_sold['Bedrooms'].dtype == np.float64
+    assert list(streamed_active.index) == list(df_active.index)
+    assert list(streamed_sold.index) == list(df_sold.index)
+
+    for sort_selection in SORT_OPTIONS:
+        pd.testing.assert_frame_equal(
+            summarize(streamed_active, streamed_sold, sort_selection).reset_index(drop=True),
+            summarize(df_active, df_sold, sort_selection).reset_index(drop=True),
+            check_dtype=False, check_categorical=False)
+
+    eager, streamed = CompMatcher(df_sold), CompMatcher(streamed_sold)
+    for flags in itertools.product([False, True], repeat=5):
+        expected = eager.match(df_active, *flags, 15)
+        got = streamed.match(streamed_active, *flags, 15)
+        np.testing.assert_array_equal(got.num_comps, expected.num_comps)
+        np.testing.assert_allclose(got.avg_comp_price, expected.avg_comp_price, equal_nan=True)
+        np.testing.assert_allclose(got.price_diff_pct, expected.price_diff_pct, equal_nan=True)
+        for i in range(0, len(df_active), 50):
+            assert list(got.comps(i).index) == list(expected.comps(i).index)
@@ -0,0 +1,87 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from comps import normalize_key
+from store import CompsStore
+
+
+def comps_export(rows):
+    # rows: (MLS #, County, Zip, Sale Price, status) as load_mls_csv would hand them over.
+    df = pd.DataFrame(rows, columns=['MLS #', 'County', 'Zip', 'Sale Price', 'Status'])
+    df['Sub'] = 'Oak Park'
+    df['Total Finished SF'] = 1500.0
+    df['Close Dt'] = pd.Timestamp('2024-06-01')
+    df['Status'] = df['Status'].astype('category')
+    return df
+
+
+def stored(store, counties=None, zips=None):
+    df = store.load(counties, zips)
+    return df.set_index('MLS #')['Sale Price'].to_dict() if len(df) else {}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return CompsStore(str(tmp_path / 'store'))
+
+
+def test_repeated_mls_moves_to_new_partition(store):
+    store.append(comps_export([
+        ('A1', 'Wake', '27601', 300_000, 'sold'),
+        ('A2', 'Wake', '27602', 310_000, 'sold'),
+    ]))
+    assert store.partitions() == ['County=wake/Zip=27601', 'County=wake/Zip=27602']
+
+    # A1 is relisted under another ZIP (and padded MLS #) in the next export.
+    store.append(comps_export([(' A1 ', ' WAKE', '27602 ', 320_000, 'sold')]))
+    assert store.partitions() == ['County=wake/Zip=27602']
+    assert not os.path.exists(store._path('County=wake/Zip=27601'))
+    assert store.num_rows() == 2
+    assert stored(store) == {'A1': 320_000, 'A2': 310_000}
+    assert stored(store, zips=['27601']) == {}
+    index = store.mls_index().set_index('MLS #')['Partition'].to_dict()
+    assert index == {'A1': 'County=wake/Zip=27602', 'A2': 'County=wake/Zip=27602'}
+
+
+def test_append_keeps_last_row_per_mls(store):
+    store.append(comps_export([
+        ('B1', 'Wake', '27601', 300_000, 'sold'),
+        ('B2', 'Wake', '27601', 250_000, 'sold'),
+    ]))
+    added = store.append(comps_export([
+        ('B1', 'Wake', '27601', 305_000, 'sold'),
+        ('B3', 'Durham', '27701', 200_000, 'sold'),
+        ('B1', 'Durham', '27701', 290_000, 'sold'),  # the later row wins, partition too
+    ]))
+    assert added == 2
+    assert store.num_rows() == 3
+    assert stored(store) == {'B1': 290_000, 'B2': 250_000, 'B3': 200_000}
+    assert stored(store, counties=['durham']) == {'B1': 290_000, 'B3': 200_000}
+    assert stored(store, counties=['wake']) == {'B2': 250_000}
+
+
+@pytest.mark.parametrize('same_zip, same_county', [(False, False), (True, False), (False, True), (True, True)])
+def test_sold_for_listings_prunes_by_normalized_keys(store, same_zip, same_county):
+    comps = comps_export([
+        ('C1', 'Wake', '27601', 300_000, 'sold'),
+        ('C2', ' wake', ' 27601', 310_000, 'sold'),
+        ('C3', 'WAKE ', '27602', 320_000, 'sold'),
+        ('C4', 'Durham', '27601', 330_000, 'sold'),
+        ('C5', 'durham', '27701', 340_000, 'sold'),
+        ('C6', 'Wake', '27601', 350_000, 'pending'),
+    ])
+    store.append(comps)
+    df_active = pd.DataFrame({'MLS #': ['L1', 'L2'], 'County': [' WAKE ', 'wake'], 'Zip': ['27601 ', ' 27601']})
+
+    keep = comps['Status'] == 'sold'
+    if same_county:
+        keep &= normalize_key(comps['County'], 'County').isin(normalize_key(df_active['County'], 'County'))
+    if same_zip:
+        keep &= normalize_key(comps['Zip'], 'Zip').isin(normalize_key(df_active['Zip'], 'Zip'))
+    got = store.sold_for_listings(df_active, same_zip, same_county)
+    assert sorted(got['MLS #']) == sorted(comps.loc[keep, 'MLS #'])
+    assert (got['Status'] == 'sold').all()
+    np.testing.assert_array_equal(got['Close Dt'].to_numpy(), np.full(len(got), np.datetime64('2024-06-01', 'ns')))
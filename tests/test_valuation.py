@@ -0,0 +1,133 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from analysis import comp_results
+from comps import CompMatcher
+from test_comps import legacy_comps, messy_mls
+from valuation import ESTIMATES, PLAIN, Valuation, value_comps, weighted_median
+
+
+def reference_median(value, weight):
+    # Brute-force weighted median: the midpoint of the lowest value with at least half
+    # the weight at or below it and the highest value with at least half at or above it.
+    half = weight.sum() / 2
+    lower = min(v for v in value if weight[value <= v].sum() >= half * (1 - 1e-12))
+    upper = max(v for v in value if weight[value >= v].sum() >= half * (1 - 1e-12))
+    return (lower + upper) / 2
+
+
+def legacy_value(df_active, df_sold, comp_rows, valuation, as_of):
+    # Per-listing loop over the comps the iterrows filter kept: age window, half-life
+    # decay, then a weighted mean or median of the price (or $/SF).
+    close_dt = pd.to_datetime(df_sold['Close Dt'], errors='coerce')
+    rows = []
+    for (_, row), rows_kept in zip(df_active.iterrows(), comp_rows):
+        values, weights = [], []
+        num_comps = 0
+        for j in rows_kept:
+            age = (as_of - close_dt[j]) / pd.Timedelta(days=1)
+            if valuation.max_age_days or valuation.half_life_days:
+                if pd.isna(age):
+                    continue
+                if valuation.max_age_days and age > valuation.max_age_days:
+                    continue
+            num_comps += 1
+            price = df_sold.at[j, 'Sale Price']
+            if valuation.estimate == 'ppsf':
+                sf = df_sold.at[j, 'Total Finished SF']
+                price = price / sf if sf > 0 else np.nan
+            if pd.isna(price):
+                continue
+            values.append(price)
+            weights.append(0.5 ** (max(age, 0) / valuation.half_life_days) if valuation.half_life_days else 1.0)
+        values, weights = np.array(values), np.array(weights)
+        if num_comps == 0 or not len(values):
+            comp_price = np.nan
+        elif valuation.estimate == 'mean':
+            comp_price = (values * weights).sum() / weights.sum()
+        else:
+            comp_price = reference_median(values, weights)
+        if valuation.estimate == 'ppsf':
+            comp_price *= row['Total Finished SF']
+        if num_comps and comp_price:
+            price_diff = comp_price - row['List Price']
+            rows.append((num_comps, comp_price, price_diff, price_diff / row['List Price'] * 100))
+        else:
+            rows.append((num_comps, np.nan if num_comps == 0 else comp_price, np.nan, np.nan))
+    return rows
+
+
+@pytest.fixture(scope='module')
+def data():
+    df_active = messy_mls(40, 'List Price', seed=3)
+    df_sold = messy_mls(300, 'Sale Price', seed=4)
+    rng = np.random.default_rng(5)
+    close_dt = pd.Timestamp('2024-06-30') - pd.to_timedelta(rng.integers(0, 720, len(df_sold)), unit='D')
+    df_sold['Close Dt'] = close_dt.strftime('%m/%d/%Y').where(rng.random(len(df_sold)) >= 0.1, None)
+    return df_active, df_sold, CompMatcher(df_sold)
+
+
+@pytest.mark.parametrize('n', [1, 2, 7, 10])
+def test_weighted_median_equal_weights_is_median(n):
+    rng = np.random.default_rng(n)
+    group = rng.integers(0, 5, n * 5)
+    value = np.round(rng.uniform(0, 100, len(group)), 0)  # repeated values too
+    got = weighted_median(group, value, np.ones(len(group)), 6)
+    for g in range(6):
+        expected = np.median(value[group == g]) if (group == g).any() else np.nan
+        np.testing.assert_allclose(got[g], expected, equal_nan=True)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_weighted_median_matches_brute_force(seed):
+    rng = np.random.default_rng(seed)
+    group = rng.integers(0, 8, 60)
+    value = rng.choice([100., 150., 200., 250., 300.], len(group))
+    weight = 0.5 ** (rng.uniform(0, 720, len(group)) / 90)
+    got = weighted_median(group, value, weight, 8)
+    for g in range(8):
+        expected = reference_median(value[group == g], weight[group == g]) if (group == g).any() else np.nan
+        np.testing.assert_allclose(got[g], expected, equal_nan=True)
+
+
+def test_weighted_median_exact_ties_average():
+    # Integer weights: the same as np.median over the values repeated weight times.
+    group = np.array([0, 0, 1, 1, 1, 2, 2])
+    value = np.array([1., 2., 1., 2., 3., 5., 5.])
+    weight = np.array([2., 2., 1., 1., 2., 1., 3.])
+    expected = [np.median(np.repeat(value[group == g], weight[group == g].astype(int))) for g in range(3)]
+    np.testing.assert_allclose(weighted_median(group, value, weight, 3), expected)
+
+
+@pytest.mark.parametrize('flags', [(False,) * 5, (True, False, False, False, True), (False, True, True, False, False)])
+@pytest.mark.parametrize('estimate', list(ESTIMATES))
+@pytest.mark.parametrize('max_age_days, half_life_days', [(None, None), (180, None), (None, 90), (365, 60)])
+@pytest.mark.parametrize('as_of_shift', [None, 30])
+def test_value_comps_matches_legacy_loop(data, flags, estimate, max_age_days, half_life_days, as_of_shift):
+    df_active, df_sold, matcher = data
+    valuation = Valuation(estimate, max_age_days, half_life_days)
+    latest = pd.to_datetime(df_sold['Close Dt'], errors='coerce').max()
+    as_of = None if as_of_shift is None else np.datetime64(latest + pd.Timedelta(days=as_of_shift), 'ns')
+    comp_rows = [rows for *_, rows in legacy_comps(df_active, df_sold, *flags, 15)]
+    expected = legacy_value(df_active, df_sold, comp_rows, valuation, latest if as_of is None else pd.Timestamp(as_of))
+    got = value_comps(matcher.match(df_active, *flags, 15), valuation, as_of)
+    np.testing.assert_array_equal(got[0], [e[0] for e in expected])
+    for column in range(1, 4):
+        np.testing.assert_allclose(got[column], [e[column] for e in expected], rtol=1e-9, equal_nan=True)
+
+
+@pytest.mark.parametrize('flags', list(itertools.product([False, True], repeat=5))[::5])
+def test_plain_valuation_matches_comp_matcher(data, flags):
+    df_active, _, matcher = data
+    matches = matcher.match(df_active, *flags, 15)
+    num_comps, comp_price, price_diff, price_diff_pct = value_comps(matches, PLAIN)
+    np.testing.assert_array_equal(num_comps, matches.num_comps)
+    np.testing.assert_allclose(comp_price, matches.avg_comp_price, rtol=1e-9, equal_nan=True)
+    np.testing.assert_allclose(price_diff, matches.price_diff, rtol=1e-9, equal_nan=True)
+    np.testing.assert_allclose(price_diff_pct, matches.price_diff_pct, rtol=1e-9, equal_nan=True)
+    results = comp_results(matches, PLAIN)
+    np.testing.assert_allclose(results['Avg Comp Price'], comp_price, rtol=1e-9, equal_nan=True)
+    np.testing.assert_array_equal(results['# of Comps'], num_comps)
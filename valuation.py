@@ -0,0 +1,80 @@
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from comps import latest_close, price_stats
+
+ESTIMATES = {
+    'mean': 'Mean sale price',
+    'median': 'Median sale price',
+    'ppsf': 'Median $/SF × listing SF',
+}
+
+# How a listing's matched comps are turned into one comp price. max_age_days drops
+# comps that closed longer ago than that; half_life_days weights each comp by
+# 0.5 ** (age / half_life). Ages are measured from an as-of date: the latest Close Dt
+# in the whole comps data, so the window doesn't shift with the matching criteria.
+Valuation = namedtuple('Valuation', ['estimate', 'max_age_days', 'half_life_days'])
+PLAIN = Valuation('mean', None, None)
+
+
+def weighted_median(group, value, weight, n_groups):
+    # Per-group weighted median in one sort; with equal weights this is the ordinary
+    # median (the two middle values are averaged for even counts).
+    result = np.full(n_groups, np.nan)
+    if not len(group):
+        return result
+    order = np.lexsort((value, group))
+    group, value, weight = group[order], value[order], weight[order]
+    cum = np.cumsum(weight)
+    starts = np.searchsorted(group, group, side='left')
+    within = cum - np.where(starts > 0, cum[starts - 1], 0.0)
+    half = np.bincount(group, weights=weight, minlength=n_groups)[group] / 2
+    reached = np.flatnonzero(within >= half * (1 - 1e-12))
+    groups, first = np.unique(group[reached], return_index=True)
+    pos = reached[first]
+    nxt = np.minimum(pos + 1, len(group) - 1)
+    exact = np.isclose(within[pos], half[pos]) & (group[nxt] == group[pos]) & (nxt > pos)
+    result[groups] = np.where(exact, (value[pos] + value[nxt]) / 2, value[pos])
+    return result
+
+
+def value_comps(matches, valuation, as_of=None):
+    # (# of comps, comp price, price diff, price diff %) per listing, computed over every
+    # (listing, comp) pair at once. # of comps counts the comps inside the age window.
+    # as_of defaults to the latest Close Dt among the matcher's comps.
+    n = len(matches)
+    sold = matches.matcher
+    listing, comp = matches.pairs()
+    weight = np.ones(len(listing))
+
+    if valuation.max_age_days or valuation.half_life_days:
+        if as_of is None:
+            as_of = latest_close(sold.close_dt)
+        age = (as_of - sold.close_dt[comp]) / np.timedelta64(1, 'D')
+        keep = ~np.isnan(age)
+        if valuation.max_age_days:
+            keep &= age <= valuation.max_age_days
+        if valuation.half_life_days:
+            weight = 0.5 ** (np.maximum(age, 0) / valuation.half_life_days)
+        listing, comp, weight = listing[keep], comp[keep], weight[keep]
+
+    num_comps = np.bincount(listing, minlength=n)
+    value = sold.price[comp]
+    if valuation.estimate == 'ppsf':
+        with np.errstate(invalid='ignore', divide='ignore'):
+            value = np.where(sold.sf[comp] > 0, value / sold.sf[comp], np.nan)
+    has_value = ~np.isnan(value)
+    listing, value, weight = listing[has_value], value[has_value], weight[has_value]
+
+    if valuation.estimate == 'mean':
+        with np.errstate(invalid='ignore', divide='ignore'):
+            comp_price = (np.bincount(listing, weights=value * weight, minlength=n) /
+                          np.bincount(listing, weights=weight, minlength=n))
+    else:
+        comp_price = weighted_median(listing, value, weight, n)
+    if valuation.estimate == 'ppsf':
+        comp_price = comp_price * pd.to_numeric(matches.df_active['Total Finished SF'], errors='coerce').to_numpy(dtype=float)
+
+    return (num_comps,) + price_stats(matches.df_active, num_comps, comp_price)